@@ -0,0 +1,63 @@
+import json
+from functools import lru_cache
+from typing import List, Sequence, Union
+
+from questions import FRIENDSHIP_TEST_QUESTIONS
+
+# Answers are stored as one byte per question holding the chosen option
+# index. UNKNOWN marks a legacy answer whose text no longer matches any
+# option; it never counts as correct.
+UNKNOWN = 0xFF
+
+def pack_answers(indices: Sequence[int]) -> bytes:
+    return bytes(indices)
+
+def unpack_answers(packed: bytes) -> List[int]:
+    return list(packed)
+
+@lru_cache(maxsize=None)
+def _masks(length: int):
+    low7 = int.from_bytes(b'\x7f' * length, 'little')
+    high = int.from_bytes(b'\x80' * length, 'little')
+    return low7, high
+
+def score(answers: bytes, correct: bytes) -> int:
+    """Count positions where both packed answer strings hold the same option.
+
+    Both strings are XORed as one integer; a byte of the result is zero
+    exactly where the answers agree, and the SWAR zero-byte test below sets
+    the high bit of each such byte so a single popcount gives the score.
+    """
+    length = min(len(answers), len(correct))
+    if length == 0:
+        return 0
+
+    low7, high = _masks(length)
+    diff = int.from_bytes(answers[:length], 'little') ^ int.from_bytes(correct[:length], 'little')
+    zero_bytes = ~(((diff & low7) + low7) | diff | low7) & high
+
+    unknown = answers[:length].count(UNKNOWN)
+    if unknown:
+        zero_bytes &= ~int.from_bytes(
+            bytes(0x80 if a == UNKNOWN else 0 for a in answers[:length]), 'little'
+        )
+    return zero_bytes.bit_count()
+
+def from_legacy(raw: Union[str, bytes]) -> bytes:
+    """Convert a stored answer set to the packed form.
+
+    Older rows hold ``{"0": "<option text>", ...}`` JSON; packed rows are
+    returned unchanged.
+    """
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        return bytes(raw)
+
+    answers = json.loads(raw)
+    packed = bytearray()
+    for key in sorted(answers, key=int):
+        question = int(key)
+        if question < len(FRIENDSHIP_TEST_QUESTIONS):
+            packed.append(FRIENDSHIP_TEST_QUESTIONS.option_indices[question].get(answers[key], UNKNOWN))
+        else:
+            packed.append(UNKNOWN)
+    return bytes(packed)
@@ -0,0 +1,50 @@
+import gzip
+import json
+import os
+from typing import Dict, List, Optional, Union
+
+# Archived tests are stored one JSON object per line in gzip files. Each
+# line starts with the test_id so a restore can skip other tests without
+# parsing them.
+
+def encode_test(test: tuple, participants: List[tuple]) -> str:
+    test_id, creator_id, creator_answers, created_at = test
+    return json.dumps({
+        'test_id': test_id,
+        'creator_id': creator_id,
+        'creator_answers': creator_answers.hex(),
+        'created_at': created_at,
+        'participants': [
+            [row_id, user_id, answers.hex(), correct_count, completed_at]
+            for row_id, user_id, answers, correct_count, completed_at in participants
+        ]
+    }, separators=(',', ':'), ensure_ascii=False)
+
+def decode_test(line: str) -> Dict:
+    record = json.loads(line)
+    record['creator_answers'] = bytes.fromhex(record['creator_answers'])
+    record['participants'] = [
+        (row_id, user_id, bytes.fromhex(answers), correct_count, completed_at)
+        for row_id, user_id, answers, correct_count, completed_at in record['participants']
+    ]
+    return record
+
+def write_archive(path: str, lines: List[str]):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line)
+            f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def find_archived_test(path: str, *test_ids: Union[int, str]) -> Optional[Dict]:
+    """First record in ``path`` whose test_id is any of ``test_ids``."""
+    prefixes = tuple('{"test_id":' + json.dumps(test_id, ensure_ascii=False) + ',' for test_id in test_ids)
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(prefixes):
+                return decode_test(line)
+    return None
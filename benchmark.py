@@ -0,0 +1,361 @@
+"""Load simulation and micro-benchmarks for the bot.
+
+Synthetic updates are fed through the real dispatcher with ``feed_update``;
+a fake Bot session records outgoing API calls instead of talking to
+Telegram. Results are written as JSON so runs can be compared across
+commits:
+
+    python benchmark.py --users 100 --output before.json
+    python benchmark.py --users 100 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# main.py reads its configuration at import time. Outbound sends are not
+# rate limited here, so the scheduler never throttles the simulation.
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+os.environ.setdefault("NOTIFY_DIGEST_WINDOW", "1")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000 if samples else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000 if samples else 0.0
+    }
+
+class RecordingSession(BaseSession):
+    """Bot session that answers every API call locally and counts them by method."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+
+        chat = Chat(id=int(getattr(method, 'chat_id', None) or 0), type='private')
+        if name in ('SendMessage', 'SendPhoto', 'SendDocument'):
+            photo = None
+            upload = getattr(method, 'photo', None) or getattr(method, 'document', None)
+            if upload is not None and hasattr(upload, 'read'):
+                async for _ in upload.read(bot):
+                    pass
+            if name == 'SendPhoto':
+                photo = [PhotoSize(file_id=f"photo{self.calls[name]}", file_unique_id='u', width=1, height=1)]
+            return Message(
+                message_id=next(self.message_ids),
+                date=datetime.now(),
+                chat=chat,
+                text=getattr(method, 'text', None),
+                photo=photo
+            )
+        return True
+
+class UpdateFactory:
+    def __init__(self):
+        self.ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> User:
+        return User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user{user_id}")
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = next(self.ids)
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=self.user(user_id),
+            text=text
+        ))
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = next(self.ids)
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id),
+            from_user=self.user(user_id),
+            chat_instance='benchmark',
+            message=Message(
+                message_id=update_id,
+                date=datetime.now(),
+                chat=Chat(id=user_id, type='private'),
+                text='benchmark'
+            ),
+            data=data
+        ))
+
+async def simulate(users: int, friends: int, concurrency: int) -> Dict:
+    """Run ``users`` creators and ``users * friends`` friends through the full flow."""
+    # main reads DB_FILE at import time, so it is imported only after run() has set it.
+    import main
+    from short_ids import encode_test_id
+
+    total_questions = len(main.FRIENDSHIP_TEST_QUESTIONS)
+    session = RecordingSession()
+    for middleware in main.bot.session.middleware:
+        session.middleware(middleware)
+    main.bot.session = session
+    updates = UpdateFactory()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(handler: str, update: Update):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await main.dp.feed_update(main.bot, update)
+            except Exception as e:
+                errors += 1
+                logging.warning(f"{handler} failed: {e}")
+            latencies[handler].append(time.perf_counter() - started)
+
+    async def creator(user_id: int) -> int:
+        await feed('cmd_start', updates.message(user_id, '/start'))
+        for i in range(total_questions):
+            await feed('process_answer', updates.callback(user_id, f"answer:{i}:{i % 2}"))
+        tests = await main.db.get_tests_by_creator(user_id, limit=1)
+        return tests[0]['test_id']
+
+    async def friend(user_id: int, test_id: int):
+        await feed('cmd_start', updates.message(user_id, f"/start {encode_test_id(test_id)}"))
+        for i in range(total_questions):
+            await feed('process_friend_answer', updates.callback(user_id, f"friend_answer:{i}:{(user_id + i) % 2}"))
+        await feed('process_name', updates.message(user_id, f"Friend {user_id}"))
+
+    await main.on_startup()
+    try:
+        started = time.perf_counter()
+        test_ids = await asyncio.gather(*(creator(1_000_000 + i) for i in range(users)))
+        await asyncio.gather(*(
+            friend(2_000_000 + i * friends + j, test_id)
+            for i, test_id in enumerate(test_ids)
+            for j in range(friends)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        await main.on_shutdown()
+
+    count = sum(len(samples) for samples in latencies.values())
+    return {
+        'updates': count,
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'throughput_per_s': count / elapsed if elapsed else 0.0,
+        'all': summarize([sample for samples in latencies.values() for sample in samples]),
+        'handlers': {handler: summarize(samples) for handler, samples in sorted(latencies.items())},
+        'api_calls': dict(sorted(session.calls.items()))
+    }
+
+async def timed(samples: List[float], coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - started)
+    return result
+
+async def benchmark_database(path: str, iterations: int) -> Dict:
+    from answers import pack_answers
+    from database import Database
+    from questions import FRIENDSHIP_TEST_QUESTIONS
+
+    total_questions = len(FRIENDSHIP_TEST_QUESTIONS)
+    db = Database(path)
+    await db.connect()
+    results: Dict[str, List[float]] = defaultdict(list)
+    creator_answers = pack_answers([0] * total_questions)
+
+    try:
+        test_ids = []
+        for i in range(iterations):
+            test_ids.append(await timed(results['save_test'], db.save_test(i, creator_answers)))
+        first = test_ids[0]
+
+        for i in range(iterations):
+            answers = pack_answers([(i + q) % 2 for q in range(total_questions)])
+            await timed(results['save_participant'], db.save_participant(first, i, answers, i % (total_questions + 1)))
+
+        for i, test_id in enumerate(test_ids):
+            db.invalidate_test(test_id)
+            await timed(results['get_test_uncached'], db.get_test(test_id))
+            await timed(results['get_test_cached'], db.get_test(test_id))
+            await timed(results['has_participant_completed'], db.has_participant_completed(first, i))
+            await timed(results['log_user_action'], db.log_user_action(i, 'start_bot'))
+
+        for _ in range(min(iterations, 200)):
+            await timed(results['get_results_summary'], db.get_results_summary(first))
+            await timed(results['get_answer_breakdown'], db.get_answer_breakdown(first))
+
+        after = None
+        for _ in range(min(iterations, 200)):
+            page = await timed(results['get_results_page'], db.get_results_page(first, after=after))
+            after = (page[-1]['correct_count'], page[-1]['id']) if len(page) == 10 else None
+    finally:
+        await db.close()
+
+    return {name: summarize(samples) for name, samples in results.items()}
+
+def benchmark_certificate(iterations: int) -> Dict:
+    from certificate import FORMATS, create_certificate, load_templates
+
+    load_templates()
+    results = {}
+    for image_format in FORMATS:
+        samples = []
+        size = 0
+        for i in range(iterations):
+            started = time.perf_counter()
+            image = create_certificate(f"Benchmark {i}", i % 9, 8, i % 9 / 8 * 100, image_format=image_format)
+            samples.append(time.perf_counter() - started)
+            size = len(image or b'')
+        results[image_format] = {**summarize(samples), 'bytes': size}
+    return results
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """Human-readable p95 and throughput changes against an earlier run."""
+    lines = []
+
+    def change(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    old_sim, new_sim = baseline.get('dispatcher', {}), current.get('dispatcher', {})
+    if old_sim and new_sim:
+        lines.append(
+            f"throughput: {new_sim['throughput_per_s']:.0f}/s vs {old_sim['throughput_per_s']:.0f}/s "
+            f"({change(new_sim['throughput_per_s'], old_sim['throughput_per_s'])})"
+        )
+        for handler, stats in new_sim['handlers'].items():
+            old = old_sim['handlers'].get(handler)
+            if old:
+                lines.append(f"dispatcher.{handler} p95: {stats['p95_ms']:.2f} ms ({change(stats['p95_ms'], old['p95_ms'])})")
+
+    for section in ('database', 'certificate'):
+        for name, stats in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old:
+                lines.append(f"{section}.{name} p95: {stats['p95_ms']:.3f} ms ({change(stats['p95_ms'], old['p95_ms'])})")
+
+    return lines
+
+def print_report(results: Dict):
+    sim = results.get('dispatcher')
+    if sim:
+        print(f"\nDispatcher: {sim['updates']} updates in {sim['elapsed_s']:.2f}s "
+              f"({sim['throughput_per_s']:.0f}/s, {sim['errors']} errors)")
+        for handler, stats in {'all': sim['all'], **sim['handlers']}.items():
+            print(f"  {handler:<26} n={stats['count']:<6} p50={stats['p50_ms']:.2f} "
+                  f"p95={stats['p95_ms']:.2f} p99={stats['p99_ms']:.2f} ms")
+
+    for section in ('database', 'certificate'):
+        if results.get(section):
+            print(f"\n{section.capitalize()}:")
+            for name, stats in results[section].items():
+                extra = f" {stats['bytes']} bytes" if 'bytes' in stats else ""
+                print(f"  {name:<26} n={stats['count']:<6} p50={stats['p50_ms']:.3f} "
+                      f"p95={stats['p95_ms']:.3f} p99={stats['p99_ms']:.3f} ms{extra}")
+
+async def run(args: argparse.Namespace) -> Dict:
+    results: Dict[str, Any] = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args)
+        }
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.skip_dispatcher:
+            os.environ["DB_FILE"] = os.path.join(tmp, "dispatcher.db")
+            results['dispatcher'] = await simulate(args.users, args.friends, args.concurrency)
+
+        if not args.skip_database:
+            results['database'] = await benchmark_database(os.path.join(tmp, "micro.db"), args.iterations)
+
+    if not args.skip_certificate:
+        results['certificate'] = benchmark_certificate(args.certificate_iterations)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot load simulation and micro-benchmarks")
+    parser.add_argument("--users", type=int, default=50, help="virtual test creators")
+    parser.add_argument("--friends", type=int, default=4, help="friends taking each creator's test")
+    parser.add_argument("--concurrency", type=int, default=64, help="updates processed at the same time")
+    parser.add_argument("--iterations", type=int, default=1000, help="database micro-benchmark iterations")
+    parser.add_argument("--certificate-iterations", type=int, default=20)
+    parser.add_argument("--skip-dispatcher", action="store_true")
+    parser.add_argument("--skip-database", action="store_true")
+    parser.add_argument("--skip-certificate", action="store_true")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} ({baseline.get('meta', {}).get('commit')}):")
+        for line in compare(results, baseline):
+            print(f"  {line}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from metrics import metrics
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "OpenSans-Bold.ttf")
+
+WIDTH, HEIGHT = 1200, 800
+
+# (minimum percentage, level, description), best level first
+LEVELS = (
+    (80, " OLTIN DARAJA ", "Siz ajoyib do'stsiz!"),
+    (60, " KUMUSH DARAJA ", "Siz yaxshi do'stsiz!"),
+    (0, " BRONZA DARAJA ", "Siz yangi do'stsiz!"),
+)
+
+# Part of every certificate cache key: bump it when the layout changes so
+# previously uploaded images are no longer reused.
+CERTIFICATE_VERSION = 1
+
+# Supported output formats and their file extensions.
+FORMATS = {
+    'png': 'png',
+    'jpeg': 'jpg',
+    'webp': 'webp',
+}
+
+# Per-process caches, filled by load_templates(). Worker processes build
+# their own copy through the pool initializer.
+_fonts: Dict[str, ImageFont.ImageFont] = {}
+_templates: Dict[str, Image.Image] = {}
+_palette: Optional[Image.Image] = None
+
+def get_level(percentage: float) -> Tuple[str, str]:
+    for threshold, level, level_desc in LEVELS:
+        if percentage >= threshold:
+            return level, level_desc
+    return LEVELS[-1][1], LEVELS[-1][2]
+
+def load_fonts() -> Dict[str, ImageFont.ImageFont]:
+    if _fonts:
+        return _fonts
+
+    try:
+        _fonts['title'] = ImageFont.truetype(FONT_PATH, 60)
+        _fonts['main'] = ImageFont.truetype(FONT_PATH, 40)
+        _fonts['date'] = ImageFont.truetype(FONT_PATH, 30)
+    except Exception as e:
+        print(f"Shrift yuklashda xatolik: {e}")
+        _fonts['title'] = _fonts['main'] = _fonts['date'] = ImageFont.load_default()
+
+    return _fonts
+
+def build_template(level: str, level_desc: str) -> Image.Image:
+    fonts = load_fonts()
+    image = Image.new('RGB', (WIDTH, HEIGHT), color='white')
+    draw = ImageDraw.Draw(image)
+
+    draw.rectangle([(40, 40), (WIDTH-40, HEIGHT-40)], outline='gold', width=5)
+    draw.rectangle([(50, 50), (WIDTH-50, HEIGHT-50)], outline='gold', width=2)
+
+    draw.text((WIDTH//2, 150), "DO'STLIK SERTIFIKATI",
+             font=fonts['title'], fill='navy', anchor="mm")
+
+    draw.text((WIDTH//2, 600), level,
+             font=fonts['main'], fill='darkred', anchor="mm")
+    draw.text((WIDTH//2, 660), level_desc,
+             font=fonts['main'], fill='darkred', anchor="mm")
+
+    return image
+
+def load_templates():
+    global _palette
+
+    if _templates:
+        return
+
+    for _, level, level_desc in LEVELS:
+        _templates[level] = build_template(level, level_desc)
+
+    # Every certificate uses the same handful of colours, so one palette
+    # taken from a sample render lets PNG output skip per-image quantizing.
+    sample = draw_certificate("Namuna Ism", 5, 8, 62.5)
+    _palette = sample.quantize(colors=64, method=Image.Quantize.FASTOCTREE)
+
+def draw_certificate(
+    name: str,
+    correct_count: int,
+    total_questions: int,
+    percentage: float,
+    issued_on: Optional[date] = None
+) -> Image.Image:
+    fonts = load_fonts()
+    level, _ = get_level(percentage)
+    image = _templates[level].copy()
+    draw = ImageDraw.Draw(image)
+
+    draw.text((WIDTH//2, 300), f"{name}",
+             font=fonts['main'], fill='black', anchor="mm")
+
+    result_text = f"Do'stlik testida {total_questions} ta savoldan"
+    draw.text((WIDTH//2, 400), result_text,
+             font=fonts['main'], fill='black', anchor="mm")
+
+    result_text2 = f"{correct_count} ta to'g'ri javob berdi"
+    draw.text((WIDTH//2, 460), result_text2,
+             font=fonts['main'], fill='black', anchor="mm")
+
+    percentage_text = f"Natija: {percentage:.1f}%"
+    draw.text((WIDTH//2, 540), percentage_text,
+             font=fonts['main'], fill='navy', anchor="mm")
+
+    current_date = (issued_on or date.today()).strftime("%d.%m.%Y")
+    draw.text((WIDTH-100, HEIGHT-100), current_date,
+             font=fonts['date'], fill='black', anchor="mm")
+
+    return image
+
+def encode_image(image: Image.Image, image_format: str = "png", quality: int = 85) -> bytes:
+    output = io.BytesIO()
+
+    if image_format == 'jpeg':
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    elif image_format == 'webp':
+        image.save(output, format='WEBP', quality=quality, method=2)
+    else:
+        if _palette is not None:
+            image = image.quantize(palette=_palette, dither=Image.Dither.NONE)
+        image.save(output, format='PNG')
+
+    return output.getvalue()
+
+def create_certificate(
+    name: str,
+    correct_count: int,
+    total_questions: int,
+    percentage: float,
+    image_format: str = "png",
+    quality: int = 85,
+    issued_on: Optional[date] = None
+) -> Optional[bytes]:
+    try:
+        load_templates()
+        image = draw_certificate(name, correct_count, total_questions, percentage, issued_on)
+        return encode_image(image, image_format, quality)
+
+    except Exception as e:
+        print(f"Sertifikat yaratishda xatolik: {e}")
+        return None
+
+def create_certificate_timed(*args) -> Tuple[Optional[bytes], float]:
+    # Runs in the worker, so the time excludes waiting for a free worker.
+    started = time.perf_counter()
+    image = create_certificate(*args)
+    return image, time.perf_counter() - started
+
+class CertificateRenderer:
+    """Runs create_certificate in a worker pool so Pillow never blocks the event loop.
+
+    At most ``max_pending`` renders may be queued or running; beyond that
+    ``render`` returns None straight away and the caller falls back to a
+    text-only reply.
+    """
+
+    def __init__(
+        self,
+        executor: str = "process",
+        workers: int = 2,
+        max_pending: int = 16,
+        image_format: str = "png",
+        quality: int = 85
+    ):
+        if image_format not in FORMATS:
+            raise ValueError(f"Noma'lum sertifikat formati: {image_format}")
+
+        self.executor_kind = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.image_format = image_format
+        self.quality = quality
+        self.pending = 0
+        self.executor: Optional[Executor] = None
+
+    def start(self):
+        if self.executor is not None:
+            return
+
+        if self.executor_kind == "thread":
+            load_templates()
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="certificate")
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=load_templates)
+
+    def shutdown(self):
+        if self.executor is None:
+            return
+
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = None
+
+    @property
+    def filename(self) -> str:
+        return f"sertifikat.{FORMATS[self.image_format]}"
+
+    def cache_key(
+        self,
+        name: str,
+        correct_count: int,
+        total_questions: int,
+        percentage: float,
+        issued_on: date
+    ) -> bytes:
+        """Digest of everything that ends up in the image, for reusing uploads."""
+        level, _ = get_level(percentage)
+        inputs = [
+            CERTIFICATE_VERSION, name, correct_count, total_questions, level,
+            issued_on.isoformat(), self.image_format, self.quality
+        ]
+        return hashlib.sha256(json.dumps(inputs, ensure_ascii=False).encode()).digest()
+
+    @property
+    def overloaded(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def render(
+        self,
+        name: str,
+        correct_count: int,
+        total_questions: int,
+        percentage: float,
+        issued_on: Optional[date] = None
+    ) -> Optional[bytes]:
+        if self.overloaded:
+            metrics.inc("bot_certificate_overloaded_total")
+            return None
+
+        self.start()
+        loop = asyncio.get_running_loop()
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            image, render_time = await loop.run_in_executor(
+                self.executor, create_certificate_timed,
+                name, correct_count, total_questions, percentage, self.image_format, self.quality, issued_on
+            )
+            metrics.observe("bot_certificate_render_seconds", render_time, format=self.image_format)
+            if image is None:
+                metrics.inc("bot_certificate_errors_total", format=self.image_format)
+            return image
+        except Exception as e:
+            metrics.inc("bot_certificate_errors_total", format=self.image_format)
+            print(f"Sertifikat yaratishda xatolik: {e}")
+            return None
+        finally:
+            self.pending -= 1
+            metrics.observe("bot_certificate_seconds", time.perf_counter() - started, format=self.image_format)
@@ -1,218 +1,750 @@
-import sqlite3
-import json
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import aiosqlite
+import asyncio
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from types import MappingProxyType
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+from datetime import date, datetime, timedelta
+from answers import UNKNOWN, from_legacy
+from archive import encode_test, find_archived_test, write_archive
+from cache import TTLCache
+from metrics import metrics
+from migrations import migrate
+from storage import Storage
 
-class Database:
-    def __init__(self, db_file: str = "friendship_test.db"):
+ACTION_TYPES = ('start_bot', 'create_test', 'complete_test')
+
+PRAGMAS = (
+    # Only takes effect on a new file; Database.optimize converts older ones.
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+class Database(Storage):
+    """Single-file SQLite backend; also used as one shard of ShardedDatabase."""
+
+    def __init__(
+        self,
+        db_file: str = "friendship_test.db",
+        event_queue_size: int = 10000,
+        event_batch_size: int = 200,
+        event_flush_interval: float = 0.5,
+        test_cache_size: int = 2048,
+        test_cache_ttl: float = 600.0,
+        archive_dir: str = "archive",
+        shard_index: int = 0,
+        shard_count: int = 1
+    ):
         self.db_file = db_file
-        self.create_tables()
-    
-    def create_tables(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tests (
-            test_id TEXT PRIMARY KEY,
-            creator_id INTEGER,
-            creator_answers TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS participants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            test_id TEXT,
-            user_id INTEGER,
-            answers TEXT,
-            correct_count INTEGER,
-            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (test_id) REFERENCES tests (test_id)
-        )
-        ''')
-        
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            action_type TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
-    def save_test(self, test_id: str, creator_id: int, creator_answers: Dict) -> bool:
+        self.archive_dir = archive_dir
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.write_lock = asyncio.Lock()
+
+        self.event_batch_size = event_batch_size
+        self.event_flush_interval = event_flush_interval
+        self.events: asyncio.Queue = asyncio.Queue(maxsize=event_queue_size)
+        self.event_writer: Optional[asyncio.Task] = None
+
+        self.test_cache = TTLCache(maxsize=test_cache_size, ttl=test_cache_ttl)
+        self.answer_converter: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        if self.conn is not None:
+            return
+
+        self.conn = await aiosqlite.connect(self.db_file)
+        for pragma in PRAGMAS:
+            await self.conn.execute(pragma)
+
+        await migrate(self.conn, (self.shard_index, self.shard_count))
+
+        self.event_writer = asyncio.create_task(self._event_writer())
+        self.answer_converter = asyncio.create_task(self._convert_legacy_answers_forever())
+
+    async def close(self):
+        if self.conn is None:
+            return
+
+        if self.answer_converter is not None:
+            self.answer_converter.cancel()
+            try:
+                await self.answer_converter
+            except asyncio.CancelledError:
+                pass
+            self.answer_converter = None
+
+        if self.event_writer is not None:
+            await self.events.put(None)
+            await self.event_writer
+            self.event_writer = None
+
+        await self.conn.close()
+        self.conn = None
+
+    @property
+    def shards(self) -> List["Database"]:
+        return [self]
+
+    def shard_for_user(self, user_id: int) -> "Database":
+        return self
+
+    def cache_stats(self) -> dict:
+        return self.test_cache.stats()
+
+    def pending_events(self) -> int:
+        return self.events.qsize()
+
+    @asynccontextmanager
+    async def transaction(self):
+        # All writers share one connection, so their transactions must not
+        # interleave: a rollback in one would discard the other's rows.
+        async with self.write_lock:
+            try:
+                yield self.conn
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    @metrics.instrument("bot_db")
+    async def save_test(self, creator_id: int, creator_answers: bytes) -> Optional[int]:
+        """Store a new test and return its id.
+
+        Ids continue from the highest live or archived id in steps of
+        ``shard_count``, so they never repeat, stay on this shard and are
+        appended at the end of the tests B-tree.
+        """
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'INSERT INTO tests (test_id, creator_id, creator_answers) VALUES (?, ?, ?)',
-                (test_id, creator_id, json.dumps(creator_answers))
-            )
-            
-            conn.commit()
-            conn.close()
-            return True
+            async with self.transaction() as conn:
+                cursor = await conn.execute(
+                    '''
+                    INSERT INTO tests (test_id, creator_id, creator_answers)
+                    SELECT MAX(
+                        IFNULL((SELECT MAX(test_id) FROM tests), ?),
+                        IFNULL((SELECT MAX(test_id) FROM archived_tests), ?)
+                    ) + ?, ?, ?
+                    ''',
+                    (self.shard_index, self.shard_index, self.shard_count, creator_id, creator_answers)
+                )
+
+            return cursor.lastrowid
         except Exception as e:
+            metrics.inc("bot_db_errors_total", method="save_test")
             print(f"Error saving test: {e}")
-            return False
-    
-    def get_test(self, test_id: str) -> Optional[Dict]:
+            return None
+
+    @metrics.instrument("bot_db")
+    async def resolve_legacy_test_id(self, legacy_id: str) -> Optional[int]:
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM tests WHERE test_id = ?', (test_id,))
-            test = cursor.fetchone()
-            
-            if test:
-                return {
-                    'test_id': test[0],
-                    'creator_id': test[1],
-                    'creator_answers': json.loads(test[2]),
-                    'created_at': test[3]
-                }
-            
+            async with self.conn.execute(
+                'SELECT test_id FROM legacy_test_ids WHERE legacy_id = ?',
+                (legacy_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="resolve_legacy_test_id")
+            print(f"Error resolving legacy test id: {e}")
+            return None
+
+    @metrics.instrument("bot_db")
+    async def get_test(self, test_id: int) -> Optional[Mapping]:
+        test = self.test_cache.get(test_id)
+        if test is not None:
+            return test
+
+        try:
+            row = await self._fetch_test(test_id)
+            if row is None and await self.restore_test(test_id):
+                row = await self._fetch_test(test_id)
+
+            if row:
+                test = MappingProxyType({
+                    'test_id': row[0],
+                    'creator_id': row[1],
+                    'creator_answers': from_legacy(row[2]),
+                    'created_at': row[3]
+                })
+                self.test_cache.set(test_id, test)
+                return test
+
             return None
         except Exception as e:
+            metrics.inc("bot_db_errors_total", method="get_test")
             print(f"Error getting test: {e}")
             return None
-    
-    def save_participant(self, test_id: str, user_id: int, answers: Dict, correct_count: int) -> bool:
+
+    async def _fetch_test(self, test_id: int) -> Optional[tuple]:
+        async with self.conn.execute(
+            'SELECT test_id, creator_id, creator_answers, created_at FROM tests WHERE test_id = ?',
+            (test_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+    def invalidate_test(self, test_id: int):
+        self.test_cache.invalidate(test_id)
+
+    @metrics.instrument("bot_db")
+    async def save_participant(self, test_id: int, user_id: int, answers: bytes, correct_count: int) -> bool:
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'INSERT INTO participants (test_id, user_id, answers, correct_count) VALUES (?, ?, ?, ?)',
-                (test_id, user_id, json.dumps(answers), correct_count)
-            )
-            
-            conn.commit()
-            conn.close()
+            async with self.transaction() as conn:
+                cursor = await conn.execute(
+                    'INSERT INTO participants (test_id, user_id, answers, correct_count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (test_id, user_id) DO NOTHING',
+                    (test_id, user_id, answers, correct_count)
+                )
+                # A repeated submission must not be counted twice.
+                if cursor.rowcount != 1:
+                    return False
+
+                await conn.executemany(
+                    '''
+                    INSERT INTO answer_counts (test_id, question, option, count) VALUES (?, ?, ?, 1)
+                    ON CONFLICT (test_id, question, option) DO UPDATE SET count = count + 1
+                    ''',
+                    [(test_id, question, option) for question, option in enumerate(answers) if option != UNKNOWN]
+                )
+
             return True
         except Exception as e:
+            metrics.inc("bot_db_errors_total", method="save_participant")
             print(f"Error saving participant: {e}")
             return False
-    
-    def get_participant_results(self, test_id: str) -> List[Dict]:
+
+    @metrics.instrument("bot_db")
+    async def get_tests_by_creator(self, creator_id: int, limit: int = 10) -> List[Dict]:
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM participants WHERE test_id = ?', (test_id,))
-            participants = cursor.fetchall()
-            
+            async with self.conn.execute('''
+                SELECT t.test_id, t.created_at,
+                       (SELECT COUNT(*) FROM participants p WHERE p.test_id = t.test_id)
+                FROM tests t
+                WHERE t.creator_id = ?
+                ORDER BY t.created_at DESC
+                LIMIT ?
+            ''', (creator_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+
             return [{
-                'id': p[0],
-                'test_id': p[1],
-                'user_id': p[2],
-                'answers': json.loads(p[3]),
-                'correct_count': p[4],
-                'completed_at': p[5]
-            } for p in participants]
-            
+                'test_id': row[0],
+                'created_at': row[1],
+                'participants': row[2]
+            } for row in rows]
         except Exception as e:
-            print(f"Error getting participants: {e}")
+            metrics.inc("bot_db_errors_total", method="get_tests_by_creator")
+            print(f"Error getting creator tests: {e}")
             return []
-    
-    def has_participant_completed(self, test_id: str, user_id: int) -> bool:
+
+    @metrics.instrument("bot_db")
+    async def get_results_summary(self, test_id: int, top: int = 5) -> Dict:
+        """Participant count, mean score, score histogram and top-N, computed in SQL."""
+        try:
+            async with self.conn.execute(
+                'SELECT correct_count, COUNT(*) FROM participants WHERE test_id = ? GROUP BY correct_count',
+                (test_id,)
+            ) as cursor:
+                histogram = {score: count for score, count in await cursor.fetchall()}
+
+            total = sum(histogram.values())
+            mean = sum(score * count for score, count in histogram.items()) / total if total else 0.0
+
+            return {
+                'count': total,
+                'mean': mean,
+                'histogram': histogram,
+                'top': await self.get_results_page(test_id, limit=top)
+            }
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="get_results_summary")
+            print(f"Error getting results summary: {e}")
+            return {}
+
+    @metrics.instrument("bot_db")
+    async def get_answer_breakdown(self, test_id: int) -> Dict[int, Dict[int, int]]:
+        """How many participants picked each option, keyed by question then option.
+
+        Read from the answer_counts rollup, so the cost depends on the number
+        of questions and options, not on how many friends took the test.
+        """
+        try:
+            breakdown: Dict[int, Dict[int, int]] = {}
+
+            async with self.conn.execute(
+                'SELECT question, option, count FROM answer_counts WHERE test_id = ?',
+                (test_id,)
+            ) as cursor:
+                async for question, option, count in cursor:
+                    breakdown.setdefault(question, {})[option] = count
+
+            return breakdown
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="get_answer_breakdown")
+            print(f"Error getting answer breakdown: {e}")
+            return {}
+
+    @metrics.instrument("bot_db")
+    async def get_results_page(
+        self,
+        test_id: int,
+        after: Optional[Tuple[int, int]] = None,
+        limit: int = 10
+    ) -> List[Dict]:
+        """One page of participants, best score first.
+
+        ``after`` is the ``(correct_count, id)`` of the last row of the
+        previous page. The page is read as two index seeks (the rest of that
+        score's run, then lower scores), so deep pages cost the same as the
+        first one.
+        """
+        columns = 'id, user_id, correct_count, completed_at, answers'
+        rows = []
+
+        if after is not None:
+            async with self.conn.execute(f'''
+                SELECT {columns} FROM participants
+                WHERE test_id = ? AND correct_count = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (test_id, after[0], after[1], limit)) as cursor:
+                rows.extend(await cursor.fetchall())
+
+        if len(rows) < limit:
+            async with self.conn.execute(f'''
+                SELECT {columns} FROM participants
+                WHERE test_id = ? AND correct_count < ?
+                ORDER BY correct_count DESC, id
+                LIMIT ?
+            ''', (test_id, after[0] if after is not None else 2 ** 31, limit - len(rows))) as cursor:
+                rows.extend(await cursor.fetchall())
+
+        return [{
+            'id': row[0],
+            'user_id': row[1],
+            'correct_count': row[2],
+            'completed_at': row[3],
+            'answers': list(from_legacy(row[4]))
+        } for row in rows]
+
+    async def iter_participants(self, test_id: int, chunk_size: int = 500) -> AsyncIterator[Dict]:
+        """Stream every participant of a test, best score first, one page in memory at a time."""
+        after = None
+        while True:
+            page = await self.get_results_page(test_id, after=after, limit=chunk_size)
+            for participant in page:
+                yield participant
+
+            if len(page) < chunk_size:
+                return
+            after = (page[-1]['correct_count'], page[-1]['id'])
+
+    @metrics.instrument("bot_db")
+    async def has_participant_completed(self, test_id: int, user_id: int) -> bool:
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT COUNT(*) FROM participants WHERE test_id = ? AND user_id = ?',
+            async with self.conn.execute(
+                'SELECT 1 FROM participants WHERE test_id = ? AND user_id = ? LIMIT 1',
                 (test_id, user_id)
-            )
-            count = cursor.fetchone()[0]
-            
-            conn.close()
-            return count > 0
-            
+            ) as cursor:
+                row = await cursor.fetchone()
+
+            return row is not None
+
         except Exception as e:
+            metrics.inc("bot_db_errors_total", method="has_participant_completed")
             print(f"Error checking participant completion: {e}")
             return False
-    
-    def log_user_action(self, user_id: int, action_type: str):
+
+    @metrics.instrument("bot_db")
+    async def convert_legacy_answers(self, batch_size: int = 500) -> int:
+        """Rewrite one batch of JSON answer rows in the packed form."""
+        converted = 0
+
+        async with self.transaction() as conn:
+            for table, key, column in (
+                ('tests', 'test_id', 'creator_answers'),
+                ('participants', 'id', 'answers'),
+            ):
+                async with conn.execute(
+                    f"SELECT {key}, {column} FROM {table} WHERE typeof({column}) = 'text' LIMIT ?",
+                    (batch_size,)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+
+                await conn.executemany(
+                    f"UPDATE {table} SET {column} = ? WHERE {key} = ?",
+                    [(from_legacy(raw), row_key) for row_key, raw in rows]
+                )
+                converted += len(rows)
+
+        return converted
+
+    async def _convert_legacy_answers_forever(self, pause: float = 0.5):
+        # Runs alongside normal traffic in small transactions until no JSON
+        # rows remain; reads decode either format in the meantime.
+        total = 0
+        while True:
+            try:
+                converted = await self.convert_legacy_answers()
+            except Exception as e:
+                print(f"Error converting legacy answers: {e}")
+                return
+
+            if not converted:
+                break
+            total += converted
+            await asyncio.sleep(pause)
+
+        if total:
+            print(f"Converted {total} answer rows to packed format")
+
+    @metrics.instrument("bot_db")
+    async def log_user_action(self, user_id: int, action_type: str):
+        # Events are written in batches by _event_writer; a full queue
+        # makes callers wait until the writer catches up.
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        await self.events.put((user_id, action_type, created_at))
+        return True
+
+    async def _event_writer(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            event = await self.events.get()
+            if event is None:
+                break
+
+            batch = [event]
+            deadline = loop.time() + self.event_flush_interval
+
+            while len(batch) < self.event_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.events.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            await self._write_events(batch)
+
+        batch = []
+        while not self.events.empty():
+            event = self.events.get_nowait()
+            if event is not None:
+                batch.append(event)
+        if batch:
+            await self._write_events(batch)
+
+    @metrics.instrument("bot_db")
+    async def _write_events(self, batch: List[tuple]):
+        rollup = Counter((created_at[:10], action_type) for _, action_type, created_at in batch)
+
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'INSERT INTO user_stats (user_id, action_type) VALUES (?, ?)',
-                (user_id, action_type)
-            )
-            
-            conn.commit()
-            conn.close()
-            return True
+            async with self.transaction() as conn:
+                await conn.executemany(
+                    'INSERT INTO user_stats (user_id, action_type, created_at) VALUES (?, ?, ?)',
+                    batch
+                )
+                await conn.executemany(
+                    '''
+                    INSERT INTO daily_stats (day, action_type, count) VALUES (?, ?, ?)
+                    ON CONFLICT (day, action_type) DO UPDATE SET count = count + excluded.count
+                    ''',
+                    [(day, action_type, count) for (day, action_type), count in rollup.items()]
+                )
         except Exception as e:
-            print(f"Error logging user action: {e}")
-            return False
-    
-    def get_daily_stats(self) -> Dict:
+            metrics.inc("bot_db_errors_total", method="_write_events")
+            print(f"Error logging user actions ({len(batch)} events lost): {e}")
+
+    @metrics.instrument("bot_db")
+    async def backfill_stats(self) -> int:
+        # Days whose raw events were pruned only exist in daily_stats, so
+        # only the days still covered by user_stats are rebuilt.
+        try:
+            async with self.transaction() as conn:
+                async with conn.execute('SELECT date(MIN(created_at)) FROM user_stats') as cursor:
+                    first_day = (await cursor.fetchone())[0]
+                if first_day is None:
+                    return 0
+
+                await conn.execute('DELETE FROM daily_stats WHERE day >= ?', (first_day,))
+                cursor = await conn.execute('''
+                    INSERT INTO daily_stats (day, action_type, count)
+                    SELECT date(created_at), action_type, COUNT(*)
+                    FROM user_stats
+                    GROUP BY date(created_at), action_type
+                ''')
+
+            return cursor.rowcount
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="backfill_stats")
+            print(f"Error backfilling stats: {e}")
+            return -1
+
+    @metrics.instrument("bot_db")
+    async def get_stats(self, start: date, end: date) -> Dict:
+        """Action totals for the days in [start, end)."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            today = datetime.now().date()
-            tomorrow = today + timedelta(days=1)
-            
-            cursor.execute('''
-                SELECT action_type, COUNT(*) 
-                FROM user_stats 
-                WHERE created_at >= ? AND created_at < ?
+            stats = dict.fromkeys(ACTION_TYPES, 0)
+
+            async with self.conn.execute('''
+                SELECT action_type, SUM(count)
+                FROM daily_stats
+                WHERE day >= ? AND day < ?
                 GROUP BY action_type
-            ''', (today.isoformat(), tomorrow.isoformat()))
-            
-            stats = {
-                'start_bot': 0,
-                'create_test': 0,
-                'complete_test': 0
-            }
-            
-            for action_type, count in cursor.fetchall():
-                stats[action_type] = count
-            
-            conn.close()
+            ''', (start.isoformat(), end.isoformat())) as cursor:
+                for action_type, count in await cursor.fetchall():
+                    stats[action_type] = count
+
             return stats
         except Exception as e:
-            print(f"Error getting daily stats: {e}")
+            metrics.inc("bot_db_errors_total", method="get_stats")
+            print(f"Error getting stats: {e}")
             return {}
-    
-    def get_monthly_stats(self) -> Dict:
+
+    @metrics.instrument("bot_db")
+    async def get_daily_breakdown(self, start: date, end: date) -> Dict[str, Dict]:
+        """Per-day action counts for the days in [start, end), keyed by ISO date."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            today = datetime.now().date()
-            first_day = today.replace(day=1)
-            next_month = (first_day + timedelta(days=32)).replace(day=1)
-            
-            cursor.execute('''
-                SELECT action_type, COUNT(*) 
-                FROM user_stats 
-                WHERE created_at >= ? AND created_at < ?
-                GROUP BY action_type
-            ''', (first_day.isoformat(), next_month.isoformat()))
-            
-            stats = {
-                'start_bot': 0,
-                'create_test': 0,
-                'complete_test': 0
-            }
-            
-            for action_type, count in cursor.fetchall():
-                stats[action_type] = count
-            
-            conn.close()
-            return stats
+            breakdown: Dict[str, Dict] = {}
+
+            async with self.conn.execute('''
+                SELECT day, action_type, count
+                FROM daily_stats
+                WHERE day >= ? AND day < ?
+                ORDER BY day
+            ''', (start.isoformat(), end.isoformat())) as cursor:
+                async for day, action_type, count in cursor:
+                    breakdown.setdefault(day, dict.fromkeys(ACTION_TYPES, 0))[action_type] = count
+
+            return breakdown
         except Exception as e:
-            print(f"Error getting monthly stats: {e}")
+            metrics.inc("bot_db_errors_total", method="get_daily_breakdown")
+            print(f"Error getting daily breakdown: {e}")
             return {}
+
+    @metrics.instrument("bot_db")
+    async def get_file_id(self, key: bytes) -> Optional[str]:
+        try:
+            async with self.conn.execute('SELECT file_id FROM file_ids WHERE key = ?', (key,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+
+            async with self.transaction() as conn:
+                await conn.execute('UPDATE file_ids SET last_used = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="get_file_id")
+            print(f"Error getting file id: {e}")
+            return None
+
+    @metrics.instrument("bot_db")
+    async def save_file_id(self, key: bytes, file_id: str):
+        try:
+            async with self.transaction() as conn:
+                await conn.execute(
+                    '''
+                    INSERT INTO file_ids (key, file_id, last_used) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET file_id = excluded.file_id, last_used = excluded.last_used
+                    ''',
+                    (key, file_id, time.time())
+                )
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="save_file_id")
+            print(f"Error saving file id: {e}")
+
+    @metrics.instrument("bot_db")
+    async def delete_file_id(self, key: bytes):
+        try:
+            async with self.transaction() as conn:
+                await conn.execute('DELETE FROM file_ids WHERE key = ?', (key,))
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", method="delete_file_id")
+            print(f"Error deleting file id: {e}")
+
+    @metrics.instrument("bot_db")
+    async def prune_file_ids(self, max_entries: int) -> int:
+        """Keep only the ``max_entries`` most recently used file_ids."""
+        async with self.transaction() as conn:
+            cursor = await conn.execute('''
+                DELETE FROM file_ids WHERE last_used < (
+                    SELECT last_used FROM file_ids ORDER BY last_used DESC LIMIT 1 OFFSET ?
+                )
+            ''', (max_entries - 1,))
+        return cursor.rowcount
+
+    @metrics.instrument("bot_db")
+    async def prune_user_stats(self, before: date) -> int:
+        """Fold raw events from days before ``before`` into daily_stats and delete them.
+
+        Each day is handled in its own transaction that recomputes the day's
+        totals from the raw rows it deletes, so an interrupted run can
+        simply be repeated.
+        """
+        pruned = 0
+        while True:
+            async with self.conn.execute('SELECT date(MIN(created_at)) FROM user_stats') as cursor:
+                day = (await cursor.fetchone())[0]
+            if day is None or day >= before.isoformat():
+                return pruned
+
+            next_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+            async with self.transaction() as conn:
+                await conn.execute('''
+                    INSERT INTO daily_stats (day, action_type, count)
+                    SELECT ?, action_type, COUNT(*)
+                    FROM user_stats
+                    WHERE created_at >= ? AND created_at < ?
+                    GROUP BY action_type
+                    ON CONFLICT (day, action_type) DO UPDATE SET count = excluded.count
+                ''', (day, day, next_day))
+                cursor = await conn.execute(
+                    'DELETE FROM user_stats WHERE created_at >= ? AND created_at < ?',
+                    (day, next_day)
+                )
+            pruned += cursor.rowcount
+
+    @metrics.instrument("bot_db")
+    async def archive_cold_tests(self, before: datetime, batch_size: int = 200) -> int:
+        """Move one batch of tests without activity since ``before`` to a gzip file.
+
+        The rows are deleted only after the file is on disk; archived_tests
+        remembers the file so get_test can restore a test on demand.
+        """
+        cutoff = before.strftime('%Y-%m-%d %H:%M:%S')
+        loop = asyncio.get_running_loop()
+
+        async with self.transaction() as conn:
+            async with conn.execute('''
+                SELECT test_id, creator_id, creator_answers, created_at
+                FROM tests t
+                WHERE created_at < ? AND NOT EXISTS (
+                    SELECT 1 FROM participants p WHERE p.test_id = t.test_id AND p.completed_at >= ?
+                )
+                LIMIT ?
+            ''', (cutoff, cutoff, batch_size)) as cursor:
+                tests = await cursor.fetchall()
+
+            if not tests:
+                return 0
+
+            lines = []
+            for test_id, creator_id, creator_answers, created_at in tests:
+                async with conn.execute(
+                    'SELECT id, user_id, answers, correct_count, completed_at FROM participants WHERE test_id = ?',
+                    (test_id,)
+                ) as cursor:
+                    participants = [
+                        (row_id, user_id, from_legacy(answers), correct_count, completed_at)
+                        for row_id, user_id, answers, correct_count, completed_at in await cursor.fetchall()
+                    ]
+                lines.append(encode_test((test_id, creator_id, from_legacy(creator_answers), created_at), participants))
+
+            name = os.path.splitext(os.path.basename(self.db_file))[0]
+            path = os.path.join(self.archive_dir, f"{name}-{datetime.utcnow():%Y%m%d%H%M%S%f}.jsonl.gz")
+            await loop.run_in_executor(None, write_archive, path, lines)
+
+            test_ids = [(test[0],) for test in tests]
+            await conn.executemany(
+                'INSERT OR REPLACE INTO archived_tests (test_id, archive_file) VALUES (?, ?)',
+                [(test_id, path) for test_id, in test_ids]
+            )
+            for table in ('answer_counts', 'participants', 'tests'):
+                await conn.executemany(f'DELETE FROM {table} WHERE test_id = ?', test_ids)
+
+        for test_id, in test_ids:
+            self.invalidate_test(test_id)
+        return len(tests)
+
+    @metrics.instrument("bot_db")
+    async def restore_test(self, test_id: int) -> bool:
+        """Bring an archived test and its participants back into the live tables."""
+        async with self.conn.execute('''
+            SELECT a.archive_file, l.legacy_id
+            FROM archived_tests a LEFT JOIN legacy_test_ids l ON l.test_id = a.test_id
+            WHERE a.test_id = ?
+        ''', (test_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return False
+
+        # Files written before tests were numbered hold the old text id.
+        keys = (test_id,) if row[1] is None else (test_id, row[1])
+        loop = asyncio.get_running_loop()
+        record = await loop.run_in_executor(None, find_archived_test, row[0], *keys)
+        if record is None:
+            print(f"Archived test {test_id} not found in {row[0]}")
+            return False
+
+        counts = Counter(
+            (question, option)
+            for _, _, answers, _, _ in record['participants']
+            for question, option in enumerate(answers)
+            if option != UNKNOWN
+        )
+
+        async with self.transaction() as conn:
+            cursor = await conn.execute('DELETE FROM archived_tests WHERE test_id = ?', (test_id,))
+            if not cursor.rowcount:
+                # Restored by a concurrent caller while the file was read.
+                return True
+
+            await conn.execute(
+                'INSERT INTO tests (test_id, creator_id, creator_answers, created_at) VALUES (?, ?, ?, ?)',
+                (test_id, record['creator_id'], record['creator_answers'], record['created_at'])
+            )
+            await conn.executemany(
+                'INSERT INTO participants (id, test_id, user_id, answers, correct_count, completed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(row_id, test_id, user_id, answers, correct_count, completed_at)
+                 for row_id, user_id, answers, correct_count, completed_at in record['participants']]
+            )
+            await conn.executemany(
+                'INSERT INTO answer_counts (test_id, question, option, count) VALUES (?, ?, ?, ?)',
+                [(test_id, question, option, count) for (question, option), count in counts.items()]
+            )
+
+        self.invalidate_test(test_id)
+        return True
+
+    @metrics.instrument("bot_db")
+    async def optimize(self, vacuum_pages: int = 1000, full_vacuum: bool = False) -> bool:
+        """Return free pages to the filesystem and refresh planner statistics.
+
+        A file created before auto_vacuum was enabled needs one full VACUUM
+        to switch to incremental mode. That blocks every writer until it
+        finishes, so it only runs when ``full_vacuum`` is set. Returns
+        whether the file is in incremental mode afterwards.
+        """
+        async with self.write_lock:
+            async with self.conn.execute('PRAGMA auto_vacuum') as cursor:
+                incremental = (await cursor.fetchone())[0] == 2
+
+            if incremental:
+                async with self.conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})') as cursor:
+                    await cursor.fetchall()
+            elif full_vacuum:
+                await self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                await self.conn.execute('VACUUM')
+                incremental = True
+
+            await self.conn.execute('PRAGMA analysis_limit = 1000')
+            await self.conn.execute('ANALYZE')
+            await self.conn.commit()
+
+            async with self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)') as cursor:
+                await cursor.fetchall()
+
+        return incremental
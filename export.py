@@ -0,0 +1,246 @@
+"""Streaming export of the bot's tables as gzip-compressed CSV or JSONL.
+
+Rows are read in chunks from a separate read-only connection per shard,
+encoded and compressed on the fly, so memory use does not depend on the
+table size. With several shards, rows get a leading ``shard`` column, since
+row ids are only unique within a shard; ``daily_stats`` is instead summed
+by ``(day, action_type)`` into one row per key. The bot sends the stream as documents with /export; the CLI
+writes it to a file:
+
+    python export.py participants --format jsonl --output participants.jsonl.gz
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiosqlite
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from answers import from_legacy
+from storage import Storage
+
+FORMATS = ('csv', 'jsonl')
+
+# Telegram rejects bot uploads over 50 MB, so bigger exports go out as
+# several documents, each a complete gzip file.
+MAX_PART_SIZE = 45 * 1024 * 1024
+
+# name -> (query, columns, index of the packed answers column or None)
+EXPORTS: Dict[str, Tuple[str, Tuple[str, ...], Optional[int]]] = {
+    'tests': (
+        'SELECT test_id, creator_id, creator_answers, created_at FROM tests',
+        ('test_id', 'creator_id', 'creator_answers', 'created_at'),
+        2
+    ),
+    'participants': (
+        'SELECT id, test_id, user_id, answers, correct_count, completed_at FROM participants',
+        ('id', 'test_id', 'user_id', 'answers', 'correct_count', 'completed_at'),
+        3
+    ),
+    'answer_counts': (
+        'SELECT test_id, question, option, count FROM answer_counts',
+        ('test_id', 'question', 'option', 'count'),
+        None
+    ),
+    'daily_stats': (
+        'SELECT day, action_type, count FROM daily_stats',
+        ('day', 'action_type', 'count'),
+        None
+    ),
+    'user_stats': (
+        'SELECT id, user_id, action_type, created_at FROM user_stats',
+        ('id', 'user_id', 'action_type', 'created_at'),
+        None
+    ),
+}
+
+# Rollup tables summed across shards: every column but the last is the key.
+SUMMED_EXPORTS = ('daily_stats',)
+
+class TableExport:
+    """One table of every shard as a stream of compressed parts.
+
+    ``next_part()`` returns an InputFile that pulls rows while it is being
+    uploaded and stops at a chunk boundary once ``max_part_size`` compressed
+    bytes have been produced; ``finished`` tells whether rows remain.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        table: str,
+        fmt: str = "csv",
+        chunk_size: int = 1000,
+        max_part_size: Optional[int] = MAX_PART_SIZE
+    ):
+        if table not in EXPORTS:
+            raise ValueError(f"Unknown table: {table}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt}")
+
+        self.db = db
+        self.table = table
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.max_part_size = max_part_size
+
+        self.query, self.columns, self.answers_column = EXPORTS[table]
+        self.sharded = len(db.shards) > 1 and table not in SUMMED_EXPORTS
+        if self.sharded:
+            self.columns = ('shard',) + self.columns
+            if self.answers_column is not None:
+                self.answers_column += 1
+        self.chunks = self._chunks()
+        self.finished = False
+        self.parts = 0
+        self.row_count = 0
+
+    async def _shard_chunks(self) -> AsyncIterator[Tuple[int, List[tuple]]]:
+        for index, shard in enumerate(self.db.shards):
+            # A connection of its own: the read keeps a consistent snapshot
+            # and never interleaves with the shard's write transactions.
+            uri = f"file:{os.path.abspath(shard.db_file)}?mode=ro"
+            async with aiosqlite.connect(uri, uri=True) as conn:
+                async with conn.execute(self.query) as cursor:
+                    while rows := await cursor.fetchmany(self.chunk_size):
+                        yield index, rows
+
+    async def _chunks(self) -> AsyncIterator[List[tuple]]:
+        if len(self.db.shards) > 1 and self.table in SUMMED_EXPORTS:
+            # Rollups are small (a few rows per day), so they are merged in memory.
+            totals: Counter = Counter()
+            async for _, rows in self._shard_chunks():
+                for *key, count in rows:
+                    totals[tuple(key)] += count
+
+            merged = [key + (count,) for key, count in sorted(totals.items())]
+            for start in range(0, len(merged), self.chunk_size):
+                yield merged[start:start + self.chunk_size]
+            return
+
+        async for index, rows in self._shard_chunks():
+            if self.sharded:
+                rows = [(index,) + row for row in rows]
+            yield rows
+
+    def _encode(self, rows: List[tuple]) -> str:
+        i = self.answers_column
+
+        if self.fmt == 'jsonl':
+            if i is not None:
+                rows = [row[:i] + (list(from_legacy(row[i])),) + row[i + 1:] for row in rows]
+            return ''.join(
+                json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + '\n'
+                for row in rows
+            )
+
+        if i is not None:
+            rows = [row[:i] + (' '.join(map(str, from_legacy(row[i]))),) + row[i + 1:] for row in rows]
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue()
+
+    async def iter_part(self) -> AsyncIterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        written = 0
+
+        if self.fmt == 'csv':
+            header = compressor.compress((','.join(self.columns) + '\n').encode())
+            if header:
+                yield header
+
+        while self.max_part_size is None or written < self.max_part_size:
+            try:
+                rows = await self.chunks.__anext__()
+            except StopAsyncIteration:
+                self.finished = True
+                break
+
+            self.row_count += len(rows)
+            chunk = compressor.compress(self._encode(rows).encode())
+            if chunk:
+                written += len(chunk)
+                yield chunk
+
+        yield compressor.flush()
+
+    def filename(self) -> str:
+        # The upload needs a name before its size is known, so only the
+        # parts after the first are numbered.
+        suffix = f"-part{self.parts}" if self.parts > 1 else ""
+        return f"{self.table}-{datetime.utcnow():%Y%m%d}{suffix}.{self.fmt}.gz"
+
+    def next_part(self) -> "ExportFile":
+        self.parts += 1
+        return ExportFile(self)
+
+    async def close(self):
+        await self.chunks.aclose()
+
+class ExportFile(InputFile):
+    """InputFile whose content is produced while the upload is in progress."""
+
+    def __init__(self, export: TableExport):
+        super().__init__(filename=export.filename())
+        self.export = export
+
+    async def read(self, bot: Bot) -> AsyncIterator[bytes]:
+        async for chunk in self.export.iter_part():
+            yield chunk
+
+async def export_to_file(db: Storage, table: str, fmt: str, output) -> int:
+    export = TableExport(db, table, fmt, max_part_size=None)
+    try:
+        async for chunk in export.iter_part():
+            output.write(chunk)
+    finally:
+        await export.close()
+    return export.row_count
+
+async def run_cli(args: argparse.Namespace) -> int:
+    from database import Database
+    from sharded_database import ShardedDatabase, shard_files
+
+    if args.shards > 1:
+        db = ShardedDatabase(shard_files(args.db, args.shards))
+    else:
+        db = Database(args.db)
+
+    for shard in db.shards:
+        if not os.path.exists(shard.db_file):
+            raise SystemExit(f"Database not found: {shard.db_file}")
+
+    if args.output == '-':
+        return await export_to_file(db, args.table, args.format, sys.stdout.buffer)
+
+    with open(args.output, 'wb') as f:
+        return await export_to_file(db, args.table, args.format, f)
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export a table as gzip-compressed CSV or JSONL")
+    parser.add_argument("table", choices=sorted(EXPORTS))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", help="output file, '-' for stdout (default: <table>.<format>.gz)")
+    parser.add_argument("--db", default=os.getenv("DB_FILE", "friendship_test.db"))
+    parser.add_argument("--shards", type=int, default=int(os.getenv("STORAGE_SHARDS", "1")))
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = f"{args.table}.{args.format}.gz"
+
+    rows = asyncio.run(run_cli(args))
+    print(f"Exported {rows} rows to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
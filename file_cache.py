@@ -0,0 +1,66 @@
+from typing import Optional
+
+from cache import TTLCache
+from storage import Storage
+
+class FileIdCache:
+    """Telegram file_ids of uploaded files, keyed by what produced them.
+
+    Sending a file_id again costs Telegram nothing and skips rendering and
+    uploading. Recent entries are kept in memory; all of them are stored
+    in the database so they survive restarts and are shared by workers.
+    The table is trimmed to the ``max_entries`` most recently used rows
+    every ``prune_every`` new entries.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        cache_size: int = 10000,
+        max_entries: int = 100000,
+        prune_every: int = 100
+    ):
+        self.db = db
+        self.memory = TTLCache(maxsize=cache_size, ttl=86400.0)
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.saved = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: bytes) -> Optional[str]:
+        file_id = self.memory.get(key)
+        if file_id is None:
+            file_id = await self.db.get_file_id(key)
+            if file_id is not None:
+                self.memory.set(key, file_id)
+
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    async def set(self, key: bytes, file_id: str):
+        self.memory.set(key, file_id)
+        await self.db.save_file_id(key, file_id)
+
+        self.saved += 1
+        if self.saved % self.prune_every == 0:
+            self.evictions += await self.db.prune_file_ids(self.max_entries)
+
+    async def invalidate(self, key: bytes):
+        """Forget a file_id Telegram no longer accepts."""
+        self.memory.invalidate(key)
+        await self.db.delete_file_id(key)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self.memory),
+            'maxsize': self.memory.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
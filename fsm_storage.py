@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import TTLCache
+from storage import Storage
+
+NO_ANSWERS = 0xFF
+
+def encode_data(data: Dict[str, Any]) -> bytes:
+    """Pack FSM data as ``<count><answer indices...><json rest>``.
+
+    ``answers`` is a list of option indices, one byte each; everything else
+    (test_id, correct_count, ...) goes into a compact JSON tail.
+    """
+    rest = {k: v for k, v in data.items() if k != 'answers'}
+    if 'answers' in data:
+        answers = bytes(data['answers'])
+        header = bytes([len(answers)]) + answers
+    else:
+        header = bytes([NO_ANSWERS])
+
+    if not rest:
+        return header
+    return header + json.dumps(rest, separators=(',', ':'), ensure_ascii=False).encode()
+
+def decode_data(raw: Optional[bytes]) -> Dict[str, Any]:
+    if not raw:
+        return {}
+
+    count = raw[0]
+    if count == NO_ANSWERS:
+        data, tail = {}, raw[1:]
+    else:
+        data, tail = {'answers': list(raw[1:1 + count])}, raw[1 + count:]
+
+    if tail:
+        data.update(json.loads(tail))
+    return data
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the bot's SQLite database.
+
+    Recently used sessions are kept encoded in a bounded LRU/TTL cache so
+    button presses rarely touch the disk for reads; every change is written
+    through to ``fsm_sessions`` on the shard that owns the user. Sessions
+    untouched for ``session_ttl`` seconds are treated as abandoned and
+    removed by a periodic sweeper.
+
+    The cache assumes one process serves a given user. When several worker
+    processes share the database without sticky routing, set
+    ``cache_size=0`` so every read goes to SQLite.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        cache_size: int = 10000,
+        cache_ttl: float = 600.0,
+        session_ttl: float = 86400.0,
+        sweep_interval: float = 600.0
+    ):
+        self.db = db
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.session_ttl = session_ttl
+        self.sweep_interval = sweep_interval
+        self.sweeper: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> Tuple:
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+    async def _load(self, key: Tuple) -> Tuple[Optional[str], bytes]:
+        record = self.cache.get(key)
+        if record is not None:
+            return record
+
+        async with self.db.shard_for_user(key[2]).conn.execute(
+            'SELECT state, data, updated_at FROM fsm_sessions '
+            'WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?',
+            key
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None or row[2] < time.time() - self.session_ttl:
+            record = (None, b'')
+        else:
+            record = (row[0], row[1] or b'')
+
+        self.cache.set(key, record)
+        return record
+
+    async def _store(self, key: Tuple, state: Optional[str], data: bytes):
+        async with self.db.shard_for_user(key[2]).transaction() as conn:
+            if state is None and not data:
+                await conn.execute(
+                    'DELETE FROM fsm_sessions '
+                    'WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?',
+                    key
+                )
+            else:
+                await conn.execute(
+                    '''
+                    INSERT INTO fsm_sessions (bot_id, chat_id, user_id, thread_id, destiny, state, data, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                    DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                    ''',
+                    (*key, state, data, time.time())
+                )
+
+        self.cache.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self._key(key)
+        _, data = await self._load(key)
+        await self._store(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self._key(key)
+        state, _ = await self._load(key)
+        await self._store(key, state, encode_data(data) if data else b'')
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key(key))
+        return decode_data(data)
+
+    async def sweep(self) -> int:
+        removed = 0
+        for shard in self.db.shards:
+            async with shard.transaction() as conn:
+                cursor = await conn.execute(
+                    'DELETE FROM fsm_sessions WHERE updated_at < ?',
+                    (time.time() - self.session_ttl,)
+                )
+            removed += cursor.rowcount
+        return removed
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await self.sweep()
+                if removed:
+                    print(f"Removed {removed} abandoned FSM sessions")
+            except Exception as e:
+                print(f"Error sweeping FSM sessions: {e}")
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def close(self) -> None:
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            try:
+                await self.sweeper
+            except asyncio.CancelledError:
+                pass
+            self.sweeper = None
+
+        self.cache.clear()
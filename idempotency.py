@@ -0,0 +1,100 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject, Update
+
+from cache import TTLCache
+from metrics import Metrics, metrics
+
+class UserEventIsolation(BaseEventIsolation):
+    """Runs the updates of one user (FSM key) one at a time.
+
+    aiogram's SimpleEventIsolation keeps a lock for every user it has ever
+    seen; here a lock lives only while some update of its user is running
+    or waiting, so the table stays as small as the number of active users.
+    """
+
+    def __init__(self):
+        self.locks: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        lock, waiters = self.locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self.locks[key] = (lock, waiters + 1)
+
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, waiters = self.locks[key]
+            if waiters == 1:
+                del self.locks[key]
+            else:
+                self.locks[key] = (lock, waiters - 1)
+
+    async def close(self):
+        self.locks.clear()
+
+class DuplicateUpdateMiddleware(BaseMiddleware):
+    """Outer update middleware that drops updates already handled.
+
+    Telegram redelivers an update when the previous delivery was not
+    acknowledged in time; those repeat an ``update_id``. A double tap on an
+    inline button arrives as a new update, but with the same button data on
+    the same message within ``callback_window`` seconds. Both are dropped
+    before the handler runs; an update whose handler failed is forgotten so
+    it can be retried.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 10000,
+        update_ttl: float = 3600.0,
+        callback_window: float = 2.0,
+        registry: Metrics = metrics
+    ):
+        self.updates = TTLCache(maxsize=cache_size, ttl=update_ttl)
+        self.callbacks = TTLCache(maxsize=cache_size, ttl=callback_window)
+        self.metrics = registry
+
+    @staticmethod
+    def callback_key(event: Update) -> Optional[tuple]:
+        callback = event.callback_query
+        if callback is None or callback.data is None:
+            return None
+        if callback.inline_message_id:
+            return (callback.inline_message_id, callback.data)
+        if callback.message:
+            return (callback.message.chat.id, callback.message.message_id, callback.data)
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        if self.updates.get(event.update_id):
+            self.metrics.inc("bot_duplicate_updates_total", kind="update")
+            return None
+
+        callback_key = self.callback_key(event)
+        if callback_key is not None:
+            if self.callbacks.get(callback_key):
+                self.metrics.inc("bot_duplicate_updates_total", kind="callback")
+                return None
+            self.callbacks.set(callback_key, True)
+
+        self.updates.set(event.update_id, True)
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.updates.invalidate(event.update_id)
+            if callback_key is not None:
+                self.callbacks.invalidate(callback_key)
+            raise
@@ -1,187 +1,442 @@
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters.command import Command
+from aiogram.filters.command import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
-    FSInputFile,
+    BufferedInputFile,
     ReplyKeyboardMarkup,
     KeyboardButton
 )
+from aiogram.exceptions import TelegramBadRequest
 import logging
 import os
-import random
-import tempfile
-from database import Database
-from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
-
-logging.basicConfig(level=logging.INFO)
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from certificate import CertificateRenderer
+from database import Database
+from sharded_database import ShardedDatabase, shard_files
+from file_cache import FileIdCache
+from export import EXPORTS, FORMATS as EXPORT_FORMATS, TableExport
+from fsm_storage import SQLiteStorage
+from idempotency import DuplicateUpdateMiddleware, UserEventIsolation
+from throttling import ThrottlingMiddleware, parse_limit
+from maintenance import MaintenanceJob
+from metrics import (
+    HandlerMetricsMiddleware,
+    RequestMetricsMiddleware,
+    UpdateMetricsMiddleware,
+    metrics,
+    start_metrics_server
+)
+from answers import pack_answers, score
+from questions import FRIENDSHIP_TEST_QUESTIONS
+from sender import MessageScheduler
+from short_ids import decode_test_id, encode_test_id, is_legacy_test_id
+from webhook import run_webhook
+from datetime import date, timedelta
+
+logging.basicConfig(level=logging.INFO)
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN topilmadi. .env faylini tekshiring.")
 
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
 
-db = Database()
+DB_FILE = os.getenv("DB_FILE", "friendship_test.db")
+STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "1"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
 
-FRIENDSHIP_TEST_QUESTIONS = [
-    {
-        "question": "🌟 Mening eng katta orzuyim nima?",
-        "options": ["🌍 Dunyo sayohati", "💼 Katta biznes ochish", "🎓 O'qishni tugatish", "👨‍👩‍👧‍👦 Oila qurish"]
-    },
-    {
-        "question": "🎵 Qanday musiqa janrini tinglashni yaxshi ko'raman?",
-        "options": ["🎸 Rok", "🎹 Pop", "🎻 Klassik", "🎤 Rep"]
-    },
-    {
-        "question": "🍽️ Qaysi turdagi taomni yeyishni afzal ko'raman?",
-        "options": ["🥘 Milliy taomlar", "🍔 Fast food", "🥗 Sog'lom taomlar", "🦐 Dengiz mahsulotlari"]
-    },
-    {
-        "question": "⭐ Bo'sh vaqtimda nima qilishni yoqtiraman?",
-        "options": ["📱 Ijtimoiy tarmoqlar", "🎬 Serial ko'rish", "🎮 O'yin o'ynash", "📚 Kitob o'qish"]
-    },
-    {
-        "question": "💭 Mening hayotdagi shiorim (motto) qanday?",
-        "options": ["✨ Har kuni yangi imkoniyat", "💪 Hech qachon taslim bo'lma", "🌠 Orzu qil va ishon", "🤝 Do'stlik eng muhimi"]
-    },
-    {
-        "question": "😮 Qiyin vaziyatlarda o'zimni qanday tutaman?",
-        "options": ["😊 Kulib turib yechim izlayman", "🤔 Chuqur o'ylab ko'raman", "👥 Do'stlardan maslahat so'rayman", "⚡ Muammoni darhol hal qilaman"]
-    },
-    {
-        "question": "🎁 Qanday sovg'a olishni yoqtiraman?",
-        "options": ["🎨 Qo'lda yasalgan", "💎 Qimmatbaho", "🎫 Tajriba/Sayohat", "📱 Texnika"]
+if STORAGE_SHARDS > 1:
+    db = ShardedDatabase(shard_files(DB_FILE, STORAGE_SHARDS), archive_dir=ARCHIVE_DIR)
+else:
+    db = Database(DB_FILE, archive_dir=ARCHIVE_DIR)
+
+maintenance = MaintenanceJob(
+    db,
+    interval=float(os.getenv("MAINTENANCE_INTERVAL", "86400")),
+    stats_retention_days=int(os.getenv("STATS_RETENTION_DAYS", "90")),
+    archive_after_days=int(os.getenv("ARCHIVE_AFTER_DAYS", "60"))
+)
+
+fsm_storage = SQLiteStorage(
+    db,
+    cache_size=int(os.getenv("FSM_CACHE_SIZE", "10000")),
+    session_ttl=float(os.getenv("FSM_SESSION_TTL", "86400"))
+)
+dp = Dispatcher(storage=fsm_storage, events_isolation=UserEventIsolation())
+dp.update.outer_middleware(DuplicateUpdateMiddleware(
+    callback_window=float(os.getenv("DUPLICATE_CALLBACK_WINDOW", "2"))
+))
+
+metrics.slow_update_threshold = float(os.getenv("SLOW_UPDATE_MS", "1000")) / 1000
+throttling = ThrottlingMiddleware(
+    limits={
+        'cmd_start': parse_limit(os.getenv("THROTTLE_START", "5/30")),
+        'message': parse_limit(os.getenv("THROTTLE_MESSAGE", "20/10")),
+        'callback_query': parse_limit(os.getenv("THROTTLE_CALLBACK", "40/10")),
     },
-    {
-        "question": "🔮 Kelajakda o'zimni qayerda ko'raman?",
-        "options": ["🌆 Katta shaharda", "🏡 Tinch qishloqda", "✈️ Chet elda", "👨‍👩‍👧‍👦 Oilam yonida"]
-    }
-]
+    max_concurrency=int(os.getenv("THROTTLE_CONCURRENCY", "100")),
+    max_wait=float(os.getenv("THROTTLE_MAX_WAIT", "5")),
+    exempt={ADMIN_ID}
+)
+
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(RequestMetricsMiddleware())
+metrics_server = None
+
+notifier = MessageScheduler(
+    bot,
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", "25")),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", "1")),
+    digest_window=float(os.getenv("NOTIFY_DIGEST_WINDOW", "10"))
+)
+
+certificates = CertificateRenderer(
+    executor=os.getenv("CERT_EXECUTOR", "process"),
+    workers=int(os.getenv("CERT_WORKERS", "2")),
+    max_pending=int(os.getenv("CERT_QUEUE_SIZE", "16")),
+    image_format=os.getenv("CERT_FORMAT", "png"),
+    quality=int(os.getenv("CERT_QUALITY", "85"))
+)
+
+certificate_files = FileIdCache(
+    db,
+    cache_size=int(os.getenv("CERT_CACHE_SIZE", "10000")),
+    max_entries=int(os.getenv("CERT_CACHE_MAX_ENTRIES", "100000"))
+)
+
+@metrics.collector
+def runtime_metrics():
+    for name, stats in (
+        ("tests", db.cache_stats()),
+        ("fsm", fsm_storage.cache.stats()),
+        ("certificates", certificate_files.stats())
+    ):
+        for key in ("hits", "misses", "evictions"):
+            yield f"bot_cache_{key}_total", "counter", {"cache": name}, stats[key]
+        yield "bot_cache_size", "gauge", {"cache": name}, stats["size"]
+    
+    yield "bot_event_queue_size", "gauge", {}, db.pending_events()
+    yield "bot_certificate_pending", "gauge", {}, certificates.pending
+    yield "bot_outbound_queue_size", "gauge", {}, notifier.queue.qsize()
+    yield "bot_handlers_running", "gauge", {}, throttling.running
+    for key in ("sent", "failed", "retried", "coalesced"):
+        yield f"bot_outbound_{key}_total", "counter", {}, getattr(notifier, key)
 
 class TestStates(StatesGroup):
     waiting_for_answer = State()
     waiting_for_name = State()
     finished = State()
 
-def get_inline_keyboard(options, prefix="answer"):
-    keyboard = []
-    for i, option in enumerate(options):
-        keyboard.append([InlineKeyboardButton(
-            text=option,
-            callback_data=f"{prefix}:{i}"
-        )])
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+def format_stats(stats):
+    return (
+        f"👥 Start bosganlar: {stats.get('start_bot', 0)}\n"
+        f"📝 Test yaratganlar: {stats.get('create_test', 0)}\n"
+        f"✍️ Test yechganlar: {stats.get('complete_test', 0)}"
+    )
+
+def format_latencies(rows, label, limit=5):
+    lines = []
+    for row in rows[:limit]:
+        line = f"{row['labels'][label]}: {row['count']} ta, p50 {row['p50'] * 1000:.0f} / p95 {row['p95'] * 1000:.0f} ms"
+        if row['errors']:
+            line += f", {row['errors']:.0f} xato"
+        lines.append(line)
+    return "\n".join(lines) or "—"
+
+def format_performance():
+    text = "⚙️ Ishlash ko'rsatkichlari (ishga tushgandan beri)\n\n"
+    
+    text += "🧩 Handlerlar:\n"
+    text += format_latencies(metrics.summary("bot_handler_seconds", "bot_handler_errors_total"), "handler", limit=10)
+    text += "\n\n🗄 Baza:\n"
+    text += format_latencies(metrics.summary("bot_db_seconds", "bot_db_errors_total"), "method")
+    text += "\n\n📡 Telegram API:\n"
+    text += format_latencies(metrics.summary("bot_api_seconds", "bot_api_errors_total"), "method")
+    
+    text += "\n\n🖼 Sertifikat:\n"
+    text += format_latencies(metrics.summary("bot_certificate_render_seconds"), "format")
+    text += f"\nNavbat to'lgani sababli matn yuborilgan: {metrics.counter('bot_certificate_overloaded_total'):.0f}"
+    
+    throttled = sum(metrics.counters.get("bot_throttled_total", {}).values())
+    duplicates = sum(metrics.counters.get("bot_duplicate_updates_total", {}).values())
+    text += (
+        f"\n\n🚦 Cheklov: {throttled:.0f} ta tashlab yuborilgan, {duplicates:.0f} ta takroriy, "
+        f"{throttling.running}/{throttling.max_concurrency} ta handler ishlamoqda"
+    )
+    
+    text += "\n\n💾 Kesh:"
+    for name, stats in (
+        ("tests", db.cache_stats()),
+        ("fsm", fsm_storage.cache.stats()),
+        ("certificates", certificate_files.stats())
+    ):
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups * 100 if lookups else 0
+        text += f"\n{name}: {hit_rate:.1f}% ({stats['hits']}/{lookups}), {stats['size']}/{stats['maxsize']}"
+    
+    slowest = metrics.slowest_updates()
+    if slowest:
+        text += f"\n\n🐢 Eng sekin yangilanishlar (>{metrics.slow_update_threshold * 1000:.0f} ms):"
+        for record in slowest[:5]:
+            text += (
+                f"\n{record['duration'] * 1000:.0f} ms — {record['handler'] or record['type']} "
+                f"(ID {record['user_id']}, {record['at']:%H:%M:%S})"
+            )
+    
+    return text
+
+STATS_DAILY_ROWS_MAX_DAYS = 62
 
 @dp.message(Command(commands=["stats"]))
-async def cmd_stats(message: types.Message):
+async def cmd_stats(message: types.Message, command: CommandObject):
     if message.from_user.id != ADMIN_ID:
         return
     
-    daily_stats = db.get_daily_stats()
-    monthly_stats = db.get_monthly_stats()
+    if command.args and command.args.strip() == "perf":
+        await message.answer(format_performance())
+        return
+    
+    if command.args:
+        try:
+            dates = [date.fromisoformat(arg) for arg in command.args.split()[:2]]
+        except ValueError:
+            await message.answer("Foydalanish: /stats [YYYY-MM-DD] [YYYY-MM-DD] yoki /stats perf")
+            return
+        
+        start_day, end_day = dates[0], dates[-1]
+        end = end_day + timedelta(days=1)
+        
+        totals = await db.get_stats(start_day, end)
+        breakdown = await db.get_daily_breakdown(start_day, end)
+        
+        stats_message = (
+            "📊 Bot Statistikasi\n\n"
+            f"📅 {start_day.isoformat()} — {end_day.isoformat()}:\n"
+            f"{format_stats(totals)}"
+        )
+        
+        # One row per day would not fit in a message for long ranges.
+        if (end_day - start_day).days > STATS_DAILY_ROWS_MAX_DAYS:
+            title = "Oylar bo'yicha"
+            rows = {}
+            for day, day_stats in breakdown.items():
+                month = rows.setdefault(day[:7], dict.fromkeys(day_stats, 0))
+                for action_type, count in day_stats.items():
+                    month[action_type] += count
+        else:
+            title = "Kunlar bo'yicha"
+            rows = breakdown
+        
+        if len(rows) > 1:
+            stats_message += f"\n\n🗓 {title} (start / yaratish / yechish):"
+            for period, period_stats in rows.items():
+                stats_message += (
+                    f"\n{period}: {period_stats.get('start_bot', 0)} / "
+                    f"{period_stats.get('create_test', 0)} / {period_stats.get('complete_test', 0)}"
+                )
+        
+        if len(stats_message) > 4096:
+            stats_message = stats_message[:4090] + "\n..."
+        await message.answer(stats_message)
+        return
+    
+    daily_stats = await db.get_daily_stats()
+    monthly_stats = await db.get_monthly_stats()
     
     stats_message = (
         "📊 Bot Statistikasi\n\n"
         "📅 Bugun:\n"
-        f"👥 Start bosganlar: {daily_stats.get('start_bot', 0)}\n"
-        f"📝 Test yaratganlar: {daily_stats.get('create_test', 0)}\n"
-        f"✍️ Test yechganlar: {daily_stats.get('complete_test', 0)}\n\n"
+        f"{format_stats(daily_stats)}\n\n"
         "📆 Shu oy:\n"
-        f"👥 Start bosganlar: {monthly_stats.get('start_bot', 0)}\n"
-        f"📝 Test yaratganlar: {monthly_stats.get('create_test', 0)}\n"
-        f"✍️ Test yechganlar: {monthly_stats.get('complete_test', 0)}"
+        f"{format_stats(monthly_stats)}\n\n"
+        "⚙️ Ishlash ko'rsatkichlari: /stats perf"
     )
     
     await message.answer(stats_message)
 
+@dp.message(Command(commands=["backfill_stats"]))
+async def cmd_backfill_stats(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    rows = await db.backfill_stats()
+    if rows < 0:
+        await message.answer("Statistikani qayta hisoblashda xatolik yuz berdi.")
+        return
+    
+    await message.answer(f"Statistika qayta hisoblandi: {rows} ta yozuv.")
+
+@dp.message(Command(commands=["maintenance"]))
+async def cmd_maintenance(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    full_vacuum = (command.args or "").strip() == "vacuum"
+    if full_vacuum:
+        await message.answer("🧹 Texnik xizmat va to'liq VACUUM boshlandi. Tugaguncha bot javob bermasligi mumkin...")
+    else:
+        await message.answer("🧹 Texnik xizmat boshlandi...")
+    try:
+        report = await maintenance.run_once(full_vacuum=full_vacuum)
+    except Exception as e:
+        logging.exception(f"Maintenance failed: {e}")
+        await message.answer("Texnik xizmatda xatolik yuz berdi.")
+        return
+    
+    await message.answer(
+        "🧹 Texnik xizmat yakunlandi\n\n"
+        f"🗑 Eski hodisalar o'chirildi: {report['pruned_events']}\n"
+        f"📦 Arxivlangan testlar: {report['archived_tests']}\n"
+        f"💾 Baza hajmi: {report['size_before'] / 1024 / 1024:.1f} MB → {report['size_after'] / 1024 / 1024:.1f} MB"
+        + (
+            f"\n\n⚠️ {report['needs_full_vacuum']} ta baza fayli bo'sh joyni qaytarmayapti. "
+            "Bir marta /maintenance vacuum bajaring (bu vaqtda bot to'xtab turadi)."
+            if report['needs_full_vacuum'] else ""
+        )
+    )
+
+@dp.message(Command(commands=["export"]))
+async def cmd_export(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    args = (command.args or "").split()
+    if not args or args[0] not in EXPORTS or (len(args) > 1 and args[1] not in EXPORT_FORMATS):
+        await message.answer(
+            f"Foydalanish: /export <jadval> [{'|'.join(EXPORT_FORMATS)}]\n"
+            f"Jadvallar: {', '.join(EXPORTS)}"
+        )
+        return
+    
+    export = TableExport(db, args[0], args[1] if len(args) > 1 else "csv")
+    await message.answer("⏳ Eksport tayyorlanmoqda...")
+    
+    try:
+        # Each document is produced while it uploads; large tables are
+        # split into several parts to stay under Telegram's size limit.
+        while not export.finished:
+            await bot.send_document(
+                message.chat.id,
+                export.next_part(),
+                caption=f"{export.table} — {export.parts}-qism",
+                request_timeout=600
+            )
+    except Exception as e:
+        logging.exception(f"Export failed: {e}")
+        await message.answer("Eksport qilishda xatolik yuz berdi.")
+        return
+    finally:
+        await export.close()
+    
+    await message.answer(f"✅ Eksport tayyor: {export.row_count} ta yozuv, {export.parts} ta fayl.")
+
+async def resolve_test_id(code):
+    """Test id from a link, button or saved session, or None if there is no such test."""
+    if isinstance(code, int):
+        return code
+    if is_legacy_test_id(code):
+        return await db.resolve_legacy_test_id(code)
+    return decode_test_id(code)
+
 @dp.message(Command(commands=["start"]))
 async def cmd_start(message: types.Message, state: FSMContext):
-    db.log_user_action(message.from_user.id, 'start_bot')
+    await db.log_user_action(message.from_user.id, 'start_bot')
     
-    if message.text.startswith("/start test_"):
-        test_id = message.text.split()[1]
-        test_data = db.get_test(test_id)
+    args = message.text.split()
+    if len(args) > 1:
+        test_id = await resolve_test_id(args[1])
+        test_data = await db.get_test(test_id) if test_id is not None else None
         
         if not test_data:
             await message.answer("Kechirasiz, bu test topilmadi yoki yaroqsiz!")
             return
         
-        if db.has_participant_completed(test_id, message.from_user.id):
+        if await db.has_participant_completed(test_id, message.from_user.id):
             await message.answer("Siz bu testni allaqachon yechib bo'lgansiz!")
             return
         
-        await state.update_data(test_id=test_id, current_question=0, answers={})
+        await state.update_data(test_id=test_id, answers=[])
         await state.set_state(TestStates.waiting_for_answer)
         
-        question = FRIENDSHIP_TEST_QUESTIONS[0]
-        keyboard = get_inline_keyboard(question['options'], "friend_answer")
-        
         await message.answer(
             "Salom! Sizning do'stingiz test yaratdi.\n"
             "Iltimos, savollarga javob bering va ko'ramiz qanchalik yaxshi bilasiz!\n\n"
-            f"1 {question['question']}", 
-            reply_markup=keyboard
+            f"{FRIENDSHIP_TEST_QUESTIONS.text(0)}", 
+            reply_markup=FRIENDSHIP_TEST_QUESTIONS.keyboard(0, "friend_answer")
         )
     else:
         await state.set_state(TestStates.waiting_for_answer)
-        await state.update_data(current_question=0, answers={})
-        
-        question = FRIENDSHIP_TEST_QUESTIONS[0]
-        keyboard = get_inline_keyboard(question['options'])
+        await state.update_data(answers=[])
         
         await message.answer(
             "Salom! Keling, do'stlaringiz uchun test yaratamiz.\n"
             "Avval siz savollarga javob bering, keyin do'stlaringiz ham javob beradi.\n\n"
-            f"1 {question['question']}", 
-            reply_markup=keyboard
+            f"{FRIENDSHIP_TEST_QUESTIONS.text(0)}", 
+            reply_markup=FRIENDSHIP_TEST_QUESTIONS.keyboard(0)
         )
 
+def parse_answer(callback_data, current_question):
+    """Option picked on the keyboard of ``current_question``, or None for a stale button.
+
+    Buttons carry their question number, so a second tap on an already
+    answered question is not taken as the answer to the next one.
+    """
+    parts = callback_data.split(":")
+    if len(parts) == 3:
+        if int(parts[1]) != current_question:
+            return None
+        option = int(parts[2])
+    else:
+        # Keyboards sent before buttons carried the question number.
+        option = int(parts[1])
+    
+    if not FRIENDSHIP_TEST_QUESTIONS.is_valid_answer(current_question, option):
+        return None
+    return option
+
 @dp.callback_query(lambda c: c.data.startswith("answer:"))
 async def process_answer(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
     
     data = await state.get_data()
-    current_question = data.get('current_question', 0)
-    answers = data.get('answers', {})
-    
-    answer_index = int(callback.data.split(":")[1])
-    answers[current_question] = FRIENDSHIP_TEST_QUESTIONS[current_question]['options'][answer_index]
+    answers = data.get('answers', [])
     
-    current_question += 1
+    option = parse_answer(callback.data, len(answers))
+    if option is None:
+        return
+    answers.append(option)
+    current_question = len(answers)
     
     if current_question < len(FRIENDSHIP_TEST_QUESTIONS):
-        question = FRIENDSHIP_TEST_QUESTIONS[current_question]
-        keyboard = get_inline_keyboard(question['options'])
-        
-        question_number = ["1", "2", "3", "4", "5", "6", "7", "8"][current_question]
-        
-        await state.update_data(current_question=current_question, answers=answers)
+        await state.update_data(answers=answers)
         await callback.message.edit_text(
-            f"{question_number} {question['question']}", 
-            reply_markup=keyboard
+            FRIENDSHIP_TEST_QUESTIONS.text(current_question), 
+            reply_markup=FRIENDSHIP_TEST_QUESTIONS.keyboard(current_question)
         )
     else:
-        test_id = f"test_{callback.from_user.id}_{random.randint(1000, 9999)}"
+        test_id = await db.save_test(callback.from_user.id, pack_answers(answers))
+        await db.log_user_action(callback.from_user.id, 'create_test')
         
-        test_data = db.save_test(test_id, callback.from_user.id, answers)
-        db.log_user_action(callback.from_user.id, 'create_test')
-        
-        if not test_data:
+        if test_id is None:
             await callback.message.edit_text("Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
             return
         
-        share_text = f"Do'stlik testi!\n\nKeling, bilimingizni sinab ko'ramiz! Qani ko'raylik-chi, meni qanchalik yaxshi bilasiz?\n\n https://t.me/friendschek_bot?start={test_id}"
+        link = f"https://t.me/friendschek_bot?start={encode_test_id(test_id)}"
+        share_text = f"Do'stlik testi!\n\nKeling, bilimingizni sinab ko'ramiz! Qani ko'raylik-chi, meni qanchalik yaxshi bilasiz?\n\n {link}"
         
         share_button = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(
@@ -194,7 +449,7 @@ async def process_answer(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.edit_text(
             "Sizning testingiz tayyor! Endi do'stlaringiz bilan ulashing.\n\n"
             "Do'stlaringiz javob berganida, men sizga natijalarni yuboraman.\n\n"
-            f"Test linki: https://t.me/friendschek_bot?start={test_id}",
+            f"Test linki: {link}",
             reply_markup=share_button
         )
 
@@ -204,36 +459,44 @@ async def process_friend_answer(callback: types.CallbackQuery, state: FSMContext
     
     data = await state.get_data()
     test_id = data.get('test_id')
-    current_question = data.get('current_question', 0)
-    answers = data.get('answers', {})
-    
-    answer_index = int(callback.data.split(":")[1])
-    answers[current_question] = FRIENDSHIP_TEST_QUESTIONS[current_question]['options'][answer_index]
+    answers = data.get('answers', [])
     
-    current_question += 1
+    option = parse_answer(callback.data, len(answers))
+    if option is None or test_id is None:
+        return
+    answers.append(option)
+    current_question = len(answers)
     
     if current_question < len(FRIENDSHIP_TEST_QUESTIONS):
-        question = FRIENDSHIP_TEST_QUESTIONS[current_question]
-        keyboard = get_inline_keyboard(question['options'], "friend_answer")
-        
-        question_number = ["1", "2", "3", "4", "5", "6", "7", "8"][current_question]
-        
-        await state.update_data(current_question=current_question, answers=answers)
+        await state.update_data(answers=answers)
         await callback.message.edit_text(
-            f"{question_number} {question['question']}", 
-            reply_markup=keyboard
+            FRIENDSHIP_TEST_QUESTIONS.text(current_question), 
+            reply_markup=FRIENDSHIP_TEST_QUESTIONS.keyboard(current_question, "friend_answer")
         )
     else:
-        test_data = db.get_test(test_id)
+        # Sessions started before tests were numbered hold the old text id.
+        test_id = await resolve_test_id(test_id)
+        test_data = await db.get_test(test_id) if test_id is not None else None
+        if not test_data:
+            await state.clear()
+            await callback.message.edit_text("Kechirasiz, bu test topilmadi yoki yaroqsiz!")
+            return
         creator_answers = test_data['creator_answers']
         
-        correct_count = sum(1 for q in range(len(FRIENDSHIP_TEST_QUESTIONS))
-                          if answers.get(q) == creator_answers.get(str(q)))
+        user_answers = pack_answers(answers)
+        
+        correct_count = score(user_answers, creator_answers)
         
         percentage = (correct_count / len(FRIENDSHIP_TEST_QUESTIONS)) * 100
         
-        db.save_participant(test_id, callback.from_user.id, answers, correct_count)
-        db.log_user_action(callback.from_user.id, 'complete_test')
+        if not await db.save_participant(test_id, callback.from_user.id, user_answers, correct_count):
+            await state.clear()
+            if await db.has_participant_completed(test_id, callback.from_user.id):
+                await callback.message.edit_text("Siz bu testni allaqachon yechib bo'lgansiz!")
+            else:
+                await callback.message.edit_text("Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
+            return
+        await db.log_user_action(callback.from_user.id, 'complete_test')
         
         await callback.message.edit_text(
             f"Test yakunlandi!\n\n"
@@ -251,107 +514,238 @@ async def process_friend_answer(callback: types.CallbackQuery, state: FSMContext
             "Javoblar:\n"
         )
         
-        for i, (user_answer, correct_answer) in enumerate(zip(answers.values(), creator_answers.values())):
-            question = FRIENDSHIP_TEST_QUESTIONS[i]['question']
+        for i, (user_answer, correct_answer) in enumerate(zip(user_answers, creator_answers)):
+            question = FRIENDSHIP_TEST_QUESTIONS[i]
             emoji = "" if user_answer == correct_answer else ""
-            creator_message += f"\n{emoji} {question}\n"
-            creator_message += f"Javob: {user_answer}\n"
+            creator_message += f"\n{emoji} {question.question}\n"
+            creator_message += f"Javob: {question.options[user_answer]}\n"
             
-        await bot.send_message(test_data['creator_id'], creator_message)
+        notifier.send_coalesced(
+            test_data['creator_id'],
+            creator_message,
+            digest_line=(
+                f"• {callback.from_user.full_name}: {correct_count}/{len(FRIENDSHIP_TEST_QUESTIONS)} "
+                f"({percentage:.1f}%)"
+            ),
+            digest_header="Do'stlik testingizni yana {count} kishi yakunladi!\n"
+        )
         
         await state.set_state(TestStates.waiting_for_name)
-        await state.update_data(test_id=test_id, correct_count=correct_count)
+        await state.set_data({'test_id': test_id, 'correct_count': correct_count})
 
-def create_certificate(name: str, correct_count: int, total_questions: int, percentage: float) -> str:
-    try:
-        width, height = 1200, 800
-        image = Image.new('RGB', (width, height), color='white')
-        draw = ImageDraw.Draw(image)
-        
-        draw.rectangle([(40, 40), (width-40, height-40)], outline='gold', width=5)
-        draw.rectangle([(50, 50), (width-50, height-50)], outline='gold', width=2)
-        
-        try:
-            font_path = "OpenSans-Bold.ttf"
-            title_font = ImageFont.truetype(font_path, 60)
-            main_font = ImageFont.truetype(font_path, 40)
-            date_font = ImageFont.truetype(font_path, 30)
-        except Exception as e:
-            print(f"Shrift yuklashda xatolik: {e}")
-            title_font = ImageFont.load_default()
-            main_font = ImageFont.load_default()
-            date_font = ImageFont.load_default()
-        
-        draw.text((width//2, 150), "DO'STLIK SERTIFIKATI", 
-                 font=title_font, fill='navy', anchor="mm")
-        
-        draw.text((width//2, 300), f"{name}", 
-                 font=main_font, fill='black', anchor="mm")
-        
-        result_text = f"Do'stlik testida {total_questions} ta savoldan"
-        draw.text((width//2, 400), result_text, 
-                 font=main_font, fill='black', anchor="mm")
-        
-        result_text2 = f"{correct_count} ta to'g'ri javob berdi"
-        draw.text((width//2, 460), result_text2, 
-                 font=main_font, fill='black', anchor="mm")
-        
-        percentage_text = f"Natija: {percentage:.1f}%"
-        draw.text((width//2, 540), percentage_text, 
-                 font=main_font, fill='navy', anchor="mm")
-        
-        if percentage >= 80:
-            level = " OLTIN DARAJA "
-            level_desc = "Siz ajoyib do'stsiz!"
-        elif percentage >= 60:
-            level = " KUMUSH DARAJA "
-            level_desc = "Siz yaxshi do'stsiz!"
-        else:
-            level = " BRONZA DARAJA "
-            level_desc = "Siz yangi do'stsiz!"
-        
-        draw.text((width//2, 600), level, 
-                 font=main_font, fill='darkred', anchor="mm")
-        draw.text((width//2, 660), level_desc, 
-                 font=main_font, fill='darkred', anchor="mm")
-        
-        current_date = datetime.now().strftime("%d.%m.%Y")
-        draw.text((width-100, height-100), current_date, 
-                 font=date_font, fill='black', anchor="mm")
-        
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        image.save(temp_file.name)
-        return temp_file.name
-        
-    except Exception as e:
-        print(f"Sertifikat yaratishda xatolik: {e}")
-        return None
+RESULTS_PAGE_SIZE = 10
+
+def format_results_summary(test_id, summary):
+    total_questions = len(FRIENDSHIP_TEST_QUESTIONS)
+    count = summary.get('count', 0)
+    
+    text = (
+        f"📊 Test natijalari: {encode_test_id(test_id)}\n\n"
+        f"👥 Qatnashchilar: {count}\n"
+    )
+    if not count:
+        return text + "\nHali hech kim testni yechmagan."
+    
+    mean = summary['mean']
+    text += f"📈 O'rtacha natija: {mean:.1f}/{total_questions} ({mean / total_questions * 100:.1f}%)\n\n"
+    
+    text += "Natijalar taqsimoti:\n"
+    histogram = summary['histogram']
+    widest = max(histogram.values())
+    for correct_count in range(total_questions, -1, -1):
+        people = histogram.get(correct_count, 0)
+        bar = "▇" * round(people / widest * 10) if people else ""
+        text += f"{correct_count}/{total_questions} {bar} {people}\n"
+    
+    text += "\n🏆 Eng yaxshilar:\n"
+    for rank, participant in enumerate(summary['top'], start=1):
+        text += f"{rank}. ID {participant['user_id']} — {participant['correct_count']}/{total_questions}\n"
+    
+    return text
+
+def format_answer_breakdown(test_id, breakdown, creator_answers):
+    text = f"🧩 Savollar bo'yicha: {encode_test_id(test_id)}\n"
+    
+    for i, question in enumerate(FRIENDSHIP_TEST_QUESTIONS):
+        counts = breakdown.get(i, {})
+        total = sum(counts.values())
+        text += f"\n{FRIENDSHIP_TEST_QUESTIONS.text(i)}\n"
+        
+        for j, option in enumerate(question.options):
+            people = counts.get(j, 0)
+            percentage = people / total * 100 if total else 0
+            mark = "✅" if i < len(creator_answers) and creator_answers[i] == j else "▫️"
+            text += f"{mark} {option} — {people} ({percentage:.0f}%)\n"
+    
+    if len(text) > 4096:
+        text = text[:4090] + "\n..."
+    return text
+
+async def can_view_results(user_id, test_id):
+    test_data = await db.get_test(test_id)
+    return test_data is not None and (test_data['creator_id'] == user_id or user_id == ADMIN_ID)
+
+async def show_results_summary(message, test_id, edit=False):
+    summary = await db.get_results_summary(test_id)
+    text = format_results_summary(test_id, summary)
+    code = encode_test_id(test_id)
+    
+    buttons = []
+    if summary.get('count', 0):
+        buttons.append([InlineKeyboardButton(
+            text="🧩 Savollar bo'yicha",
+            callback_data=f"results:{code}:answers"
+        )])
+    if summary.get('count', 0) > len(summary.get('top', [])):
+        buttons.append([InlineKeyboardButton(
+            text="Barcha natijalar ▶️",
+            callback_data=f"results:{code}:start"
+        )])
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+    
+    if edit:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+
+@dp.message(Command(commands=["results"]))
+async def cmd_results(message: types.Message, command: CommandObject):
+    if command.args:
+        test_id = await resolve_test_id(command.args.split()[0])
+        if test_id is None or not await can_view_results(message.from_user.id, test_id):
+            await message.answer("Bu test topilmadi yoki uning natijalarini ko'rishga ruxsat yo'q.")
+            return
+        await show_results_summary(message, test_id)
+        return
+    
+    tests = await db.get_tests_by_creator(message.from_user.id)
+    if not tests:
+        await message.answer("Sizda hali test yo'q. Test yaratish uchun /start bosing.")
+        return
+    
+    if len(tests) == 1:
+        await show_results_summary(message, tests[0]['test_id'])
+        return
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"{test['created_at'][:10]} — {test['participants']} ta qatnashchi",
+            callback_data=f"results:{encode_test_id(test['test_id'])}"
+        )]
+        for test in tests
+    ])
+    await message.answer("Qaysi test natijalarini ko'rmoqchisiz?", reply_markup=keyboard)
+
+@dp.callback_query(lambda c: c.data.startswith("results:"))
+async def process_results(callback: types.CallbackQuery):
+    await callback.answer()
+    
+    # results:<test_id>                              -> summary
+    # results:<test_id>:answers                      -> per-question breakdown
+    # results:<test_id>:start                        -> first page
+    # results:<test_id>:<score>:<id>:<rank offset>   -> page after (score, id)
+    parts = callback.data.split(":")
+    test_id = await resolve_test_id(parts[1])
+    
+    if test_id is None or not await can_view_results(callback.from_user.id, test_id):
+        return
+    code = encode_test_id(test_id)
+    
+    if len(parts) == 2:
+        await show_results_summary(callback.message, test_id, edit=True)
+        return
+    
+    if parts[2] == "answers":
+        test_data = await db.get_test(test_id)
+        breakdown = await db.get_answer_breakdown(test_id)
+        await callback.message.edit_text(
+            format_answer_breakdown(test_id, breakdown, test_data['creator_answers']),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="📊 Umumiy", callback_data=f"results:{code}")
+            ]])
+        )
+        return
+    
+    if parts[2] == "start":
+        after, offset = None, 0
+    else:
+        after, offset = (int(parts[2]), int(parts[3])), int(parts[4])
+    
+    page = await db.get_results_page(test_id, after=after, limit=RESULTS_PAGE_SIZE)
+    total_questions = len(FRIENDSHIP_TEST_QUESTIONS)
+    
+    text = f"📋 Natijalar: {code}\n\n"
+    for rank, participant in enumerate(page, start=offset + 1):
+        text += (
+            f"{rank}. ID {participant['user_id']} — "
+            f"{participant['correct_count']}/{total_questions} "
+            f"({participant['completed_at'][:16]})\n"
+        )
+    if not page:
+        text += "Boshqa natija yo'q."
+    
+    buttons = [InlineKeyboardButton(text="📊 Umumiy", callback_data=f"results:{code}")]
+    if len(page) == RESULTS_PAGE_SIZE:
+        last = page[-1]
+        buttons.append(InlineKeyboardButton(
+            text="Keyingi ▶️",
+            callback_data=f"results:{code}:{last['correct_count']}:{last['id']}:{offset + len(page)}"
+        ))
+    
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[buttons]))
 
 @dp.message(TestStates.waiting_for_name)
 async def process_name(message: types.Message, state: FSMContext):
     data = await state.get_data()
     test_id = data.get('test_id')
     correct_count = data.get('correct_count')
+    percentage = (correct_count / len(FRIENDSHIP_TEST_QUESTIONS)) * 100
+    caption = (
+        "Tabriklaymiz! Sizning do'stlik sertifikatingiz tayyor!\n"
+        "Yana bir bor sinab ko'rish uchun /start bosing."
+    )
     
-    cert_path = create_certificate(
+    # The same name, score and date give the same image, so a certificate
+    # Telegram already has is sent again by its file_id.
+    issued_on = date.today()
+    key = certificates.cache_key(
+        message.text, correct_count, len(FRIENDSHIP_TEST_QUESTIONS), percentage, issued_on
+    )
+    file_id = await certificate_files.get(key)
+    if file_id:
+        try:
+            await message.answer_photo(photo=file_id, caption=caption)
+            await state.clear()
+            return
+        except TelegramBadRequest:
+            await certificate_files.invalidate(key)
+    
+    if certificates.overloaded:
+        metrics.inc("bot_certificate_overloaded_total")
+        await message.answer(
+            f"{message.text}, natijangiz: {correct_count}/{len(FRIENDSHIP_TEST_QUESTIONS)} "
+            f"({percentage:.1f}%)\n\n"
+            "Hozir sertifikatlar navbati band, shuning uchun natijani matn ko'rinishida yubordik.\n"
+            "Yana bir bor sinab ko'rish uchun /start bosing."
+        )
+        await state.clear()
+        return
+    
+    certificate = await certificates.render(
         name=message.text,
         correct_count=correct_count,
         total_questions=len(FRIENDSHIP_TEST_QUESTIONS),
-        percentage=(correct_count / len(FRIENDSHIP_TEST_QUESTIONS)) * 100
+        percentage=percentage,
+        issued_on=issued_on
     )
     
-    if cert_path and os.path.exists(cert_path):
-        try:
-            await message.answer_photo(
-                photo=FSInputFile(cert_path),
-                caption="Tabriklaymiz! Sizning do'stlik sertifikatingiz tayyor!\n"
-                       "Yana bir bor sinab ko'rish uchun /start bosing."
-            )
-        finally:
-            try:
-                os.remove(cert_path)
-            except Exception as e:
-                print(f"Faylni o'chirishda xatolik: {e}")
+    if certificate:
+        sent = await message.answer_photo(
+            photo=BufferedInputFile(certificate, filename=certificates.filename),
+            caption=caption
+        )
+        if sent.photo:
+            await certificate_files.set(key, sent.photo[-1].file_id)
     else:
         await message.answer(
             "Sertifikat yaratishda xatolik yuz berdi.\n"
@@ -360,8 +754,53 @@ async def process_name(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+async def on_startup():
+    global metrics_server
+    
+    await db.connect()
+    fsm_storage.start()
+    certificates.start()
+    notifier.start()
+    maintenance.start()
+    
+    if METRICS_PORT and metrics_server is None:
+        metrics_server = await start_metrics_server(
+            metrics,
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            port=METRICS_PORT
+        )
+
+async def on_shutdown():
+    global metrics_server
+    
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+        metrics_server = None
+    
+    await maintenance.close()
+    await notifier.close()
+    certificates.shutdown()
+    await fsm_storage.close()
+    await db.close()
+
 async def main():
-    await dp.start_polling(bot)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    
+    if BOT_MODE == "webhook":
+        await run_webhook(
+            dp, bot,
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8080")),
+            reuse_port=os.getenv("WEBHOOK_REUSE_PORT", "0") == "1",
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            max_concurrency=int(os.getenv("WEBHOOK_CONCURRENCY", "64")),
+            max_pending=int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+        )
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     import asyncio
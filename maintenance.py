@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from storage import Storage
+
+class MaintenanceJob:
+    """Periodic housekeeping that keeps the live database small.
+
+    On every shard it folds raw ``user_stats`` rows older than
+    ``stats_retention_days`` into ``daily_stats``, archives tests with no
+    activity for ``archive_after_days`` to gzip files (restored on demand
+    by ``get_test``), then runs an incremental vacuum and ANALYZE.
+    A retention of 0 days turns that step off. Files not yet in
+    incremental auto_vacuum mode are only converted by an explicit
+    ``run_once(full_vacuum=True)``.
+    """
+
+    def __init__(
+        self,
+        db: Storage,
+        interval: float = 86400.0,
+        stats_retention_days: int = 90,
+        archive_after_days: int = 60,
+        archive_batch_size: int = 200,
+        vacuum_pages: int = 1000
+    ):
+        self.db = db
+        self.interval = interval
+        self.stats_retention_days = stats_retention_days
+        self.archive_after_days = archive_after_days
+        self.archive_batch_size = archive_batch_size
+        self.vacuum_pages = vacuum_pages
+        self.task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    async def run_once(self, full_vacuum: bool = False) -> Dict:
+        async with self.lock:
+            now = datetime.utcnow()
+            report = {
+                'pruned_events': 0,
+                'archived_tests': 0,
+                'size_before': 0,
+                'size_after': 0,
+                'needs_full_vacuum': 0
+            }
+
+            for shard in self.db.shards:
+                report['size_before'] += os.path.getsize(shard.db_file)
+
+                if self.stats_retention_days:
+                    before = now.date() - timedelta(days=self.stats_retention_days)
+                    report['pruned_events'] += await shard.prune_user_stats(before)
+
+                if self.archive_after_days:
+                    before = now - timedelta(days=self.archive_after_days)
+                    while archived := await shard.archive_cold_tests(before, self.archive_batch_size):
+                        report['archived_tests'] += archived
+                        await asyncio.sleep(0)
+
+                if not await shard.optimize(self.vacuum_pages, full_vacuum):
+                    report['needs_full_vacuum'] += 1
+                report['size_after'] += os.path.getsize(shard.db_file)
+
+            return report
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                report = await self.run_once()
+                logging.info(
+                    f"Maintenance: pruned {report['pruned_events']} events, "
+                    f"archived {report['archived_tests']} tests, "
+                    f"{report['size_before']} -> {report['size_after']} bytes"
+                )
+                if report['needs_full_vacuum']:
+                    logging.warning(
+                        f"{report['needs_full_vacuum']} database file(s) are not in incremental "
+                        "auto_vacuum mode; run /maintenance vacuum once to convert them"
+                    )
+            except Exception as e:
+                logging.exception(f"Maintenance failed: {e}")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run_forever())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,262 @@
+import heapq
+import itertools
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+# Upper bounds in seconds, Prometheus style: a sample lands in the first
+# bucket it does not exceed.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, str, Dict[str, Any], float]
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f'{{{pairs}}}' if pairs else ''
+
+class Metrics:
+    """In-process latency histograms and counters, rendered in Prometheus text format.
+
+    ``track(prefix, **labels)`` times a block into ``<prefix>_seconds`` and
+    counts exceptions escaping it in ``<prefix>_errors_total``. Updates that
+    take longer than ``slow_update_threshold`` seconds are logged and the
+    slowest ``slow_update_top`` are kept for /stats.
+    """
+
+    def __init__(self, slow_update_threshold: float = 1.0, slow_update_top: int = 10):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+        self.slow_update_threshold = slow_update_threshold
+        self.slow_update_top = slow_update_top
+        self.slow_updates: List[Tuple[float, int, Dict]] = []
+        self.slow_seq = itertools.count()
+
+    def observe(self, name: str, value: float, **labels: Any):
+        series = self.histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        series = self.counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def track(self, prefix: str, **labels: Any):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{prefix}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{prefix}_seconds", time.perf_counter() - started, **labels)
+
+    def instrument(self, prefix: str):
+        """Decorator for coroutine methods, labelled with the method name."""
+        def decorator(func: Callable[..., Awaitable]):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.track(prefix, method=func.__name__):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def collector(self, callback: Callable[[], Iterable[Sample]]):
+        """Register a callback yielding ``(name, type, labels, value)`` at scrape time."""
+        self.collectors.append(callback)
+        return callback
+
+    def record_update(self, duration: float, record: Dict):
+        if not self.slow_update_threshold or duration < self.slow_update_threshold:
+            return
+
+        self.inc("bot_slow_updates_total")
+        logging.warning(
+            f"Slow update {record.get('update_id')} ({record.get('type')} -> "
+            f"{record.get('handler') or '-'}): {duration * 1000:.0f} ms"
+        )
+
+        entry = (duration, next(self.slow_seq), {**record, 'duration': duration, 'at': datetime.utcnow()})
+        if len(self.slow_updates) < self.slow_update_top:
+            heapq.heappush(self.slow_updates, entry)
+        elif duration > self.slow_updates[0][0]:
+            heapq.heapreplace(self.slow_updates, entry)
+
+    def slowest_updates(self) -> List[Dict]:
+        return [record for _, _, record in sorted(self.slow_updates, reverse=True)]
+
+    def summary(self, name: str, errors: Optional[str] = None) -> List[Dict]:
+        """Per-series count, p50/p95 and error count for a histogram, busiest first."""
+        error_series = self.counters.get(errors, {}) if errors else {}
+        rows = [{
+            'labels': dict(labels),
+            'count': histogram.count,
+            'total': histogram.sum,
+            'p50': histogram.quantile(0.5),
+            'p95': histogram.quantile(0.95),
+            'errors': error_series.get(labels, 0)
+        } for labels, histogram in self.histograms.get(name, {}).items()]
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        return self.counters.get(name, {}).get(_labels(labels), 0)
+
+    def render(self) -> str:
+        lines = []
+
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        samples = []
+        for callback in self.collectors:
+            try:
+                samples.extend(callback())
+            except Exception as e:
+                logging.warning(f"Metrics collector failed: {e}")
+
+        # Lines of one metric family must be contiguous.
+        previous = None
+        for name, kind, labels, value in sorted(samples, key=lambda sample: sample[0]):
+            if name != previous:
+                lines.append(f"# TYPE {name} {kind}")
+                previous = name
+            lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: times each update end to end, FSM and filters included."""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.metrics = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        # HandlerMetricsMiddleware fills in the handler name.
+        record = data['metrics_record'] = {
+            'update_id': event.update_id,
+            'type': event.event_type,
+            'handler': None,
+            'user_id': None
+        }
+        started = time.perf_counter()
+        try:
+            with self.metrics.track("bot_update", type=event.event_type):
+                return await handler(event, data)
+        finally:
+            self.metrics.record_update(time.perf_counter() - started, record)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: times the handler callback itself, labelled by its name."""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.metrics = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        record = data.get('metrics_record')
+        if record is not None:
+            record['handler'] = name
+            user = data.get('event_from_user')
+            record['user_id'] = user.id if user else None
+
+        with self.metrics.track("bot_handler", handler=name):
+            return await handler(event, data)
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware timing every Telegram API call by method."""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.metrics = registry
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        with self.metrics.track("bot_api", method=type(method).__name__):
+            return await make_request(bot, method)
+
+async def start_metrics_server(registry: Metrics, host: str = "127.0.0.1", port: int = 9090) -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics available on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,315 @@
+import aiosqlite
+import logging
+from collections import Counter
+from typing import Awaitable, Callable, List, Tuple, Union
+
+from answers import UNKNOWN, from_legacy
+
+# (index of this file among the shards, number of shards)
+Shard = Tuple[int, int]
+Step = Union[str, Callable[[aiosqlite.Connection, Shard], Awaitable[None]]]
+
+# Ordered schema migrations. Each entry is applied once, in its own
+# transaction, and recorded in schema_version. Never edit an entry that has
+# shipped; append a new one instead.
+async def backfill_answer_counts(conn: aiosqlite.Connection, shard: Shard):
+    counts = Counter()
+    async with conn.execute('SELECT test_id, answers FROM participants') as cursor:
+        async for test_id, answers in cursor:
+            for question, option in enumerate(from_legacy(answers)):
+                if option != UNKNOWN:
+                    counts[(test_id, question, option)] += 1
+
+    await conn.executemany(
+        'INSERT INTO answer_counts (test_id, question, option, count) VALUES (?, ?, ?, ?)',
+        [(*key, count) for key, count in counts.items()]
+    )
+
+async def number_tests(conn: aiosqlite.Connection, shard: Shard):
+    """Give every live and archived test a numeric id owned by this shard.
+
+    Ids on shard ``index`` of ``count`` are ``index + count * k``, so the
+    id alone routes to the shard that already holds the test. The old
+    text ids are kept in legacy_test_ids for links already shared.
+    """
+    index, count = shard
+
+    async with conn.execute('''
+        SELECT test_id FROM (
+            SELECT test_id, archived_at AS created_at, 0 AS live FROM archived_tests
+            UNION ALL
+            SELECT test_id, created_at, 1 FROM tests
+        )
+        ORDER BY live, created_at, test_id
+    ''') as cursor:
+        legacy_ids = [row[0] for row in await cursor.fetchall()]
+
+    await conn.executemany(
+        'INSERT INTO legacy_test_ids (legacy_id, test_id) VALUES (?, ?)',
+        [(legacy_id, index + count * k) for k, legacy_id in enumerate(legacy_ids, start=1)]
+    )
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS tests (
+            test_id TEXT PRIMARY KEY,
+            creator_id INTEGER,
+            creator_answers TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id TEXT,
+            user_id INTEGER,
+            answers TEXT,
+            correct_count INTEGER,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (test_id) REFERENCES tests (test_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            action_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT,
+            action_type TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, action_type)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (2, "unique (test_id, user_id) on participants", [
+        # Older databases may already hold double submissions; keep the first.
+        '''
+        DELETE FROM participants
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM participants GROUP BY test_id, user_id
+        )
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_participants_test_user
+        ON participants (test_id, user_id)
+        ''',
+    ]),
+    (3, "secondary indexes for stats and creator lookups", [
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_created_at ON user_stats (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_tests_creator ON tests (creator_id, created_at)',
+    ]),
+    (4, "persistent FSM sessions", [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_sessions (
+            bot_id INTEGER,
+            chat_id INTEGER,
+            user_id INTEGER,
+            thread_id INTEGER,
+            destiny TEXT,
+            state TEXT,
+            data BLOB,
+            updated_at REAL,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_sessions_updated_at ON fsm_sessions (updated_at)',
+    ]),
+    (5, "track rows still holding JSON answers", [
+        # Partial indexes: they only contain rows awaiting conversion to the
+        # packed answer format, so finding the next batch never scans.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_tests_json_answers
+        ON tests (test_id) WHERE typeof(creator_answers) = 'text'
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_participants_json_answers
+        ON participants (id) WHERE typeof(answers) = 'text'
+        ''',
+    ]),
+    (6, "leaderboard index on participants", [
+        # Serves the score histogram, top-N and keyset pages of /results
+        # straight from the index.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_participants_test_score
+        ON participants (test_id, correct_count DESC, id)
+        ''',
+    ]),
+    (7, "per-question answer counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS answer_counts (
+            test_id TEXT,
+            question INTEGER,
+            option INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (test_id, question, option)
+        ) WITHOUT ROWID
+        ''',
+        backfill_answer_counts,
+    ]),
+    (8, "archived tests index and test age index", [
+        '''
+        CREATE TABLE IF NOT EXISTS archived_tests (
+            test_id TEXT PRIMARY KEY,
+            archive_file TEXT NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_tests_created_at ON tests (created_at)',
+    ]),
+    (9, "Telegram file_id cache", [
+        '''
+        CREATE TABLE IF NOT EXISTS file_ids (
+            key BLOB PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            last_used REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_file_ids_last_used ON file_ids (last_used)',
+    ]),
+    (10, "integer test ids", [
+        '''
+        CREATE TABLE legacy_test_ids (
+            legacy_id TEXT PRIMARY KEY,
+            test_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        number_tests,
+        'CREATE UNIQUE INDEX idx_legacy_test_ids_test ON legacy_test_ids (test_id)',
+        # Rebuild every table keyed by test_id with an INTEGER column. The
+        # rowid alias keeps new tests appended at the right edge of the B-tree.
+        '''
+        CREATE TABLE tests_new (
+            test_id INTEGER PRIMARY KEY,
+            creator_id INTEGER,
+            creator_answers BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        INSERT INTO tests_new (test_id, creator_id, creator_answers, created_at)
+        SELECT l.test_id, t.creator_id, t.creator_answers, t.created_at
+        FROM tests t JOIN legacy_test_ids l ON l.legacy_id = t.test_id
+        ''',
+        '''
+        CREATE TABLE participants_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id INTEGER,
+            user_id INTEGER,
+            answers BLOB,
+            correct_count INTEGER,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (test_id) REFERENCES tests (test_id)
+        )
+        ''',
+        '''
+        INSERT INTO participants_new (id, test_id, user_id, answers, correct_count, completed_at)
+        SELECT p.id, l.test_id, p.user_id, p.answers, p.correct_count, p.completed_at
+        FROM participants p JOIN legacy_test_ids l ON l.legacy_id = p.test_id
+        ''',
+        '''
+        CREATE TABLE answer_counts_new (
+            test_id INTEGER,
+            question INTEGER,
+            option INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (test_id, question, option)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO answer_counts_new (test_id, question, option, count)
+        SELECT l.test_id, a.question, a.option, a.count
+        FROM answer_counts a JOIN legacy_test_ids l ON l.legacy_id = a.test_id
+        ''',
+        '''
+        CREATE TABLE archived_tests_new (
+            test_id INTEGER PRIMARY KEY,
+            archive_file TEXT NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        INSERT INTO archived_tests_new (test_id, archive_file, archived_at)
+        SELECT l.test_id, a.archive_file, a.archived_at
+        FROM archived_tests a JOIN legacy_test_ids l ON l.legacy_id = a.test_id
+        ''',
+        # Keep participant ids of archived tests from being handed out again.
+        "DELETE FROM sqlite_sequence WHERE name = 'participants_new'",
+        '''
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'participants_new', seq FROM sqlite_sequence WHERE name = 'participants'
+        ''',
+        'DROP TABLE answer_counts',
+        'DROP TABLE participants',
+        'DROP TABLE archived_tests',
+        'DROP TABLE tests',
+        'ALTER TABLE tests_new RENAME TO tests',
+        'ALTER TABLE participants_new RENAME TO participants',
+        'ALTER TABLE answer_counts_new RENAME TO answer_counts',
+        'ALTER TABLE archived_tests_new RENAME TO archived_tests',
+        'CREATE UNIQUE INDEX idx_participants_test_user ON participants (test_id, user_id)',
+        'CREATE INDEX idx_participants_test_score ON participants (test_id, correct_count DESC, id)',
+        '''
+        CREATE INDEX idx_participants_json_answers
+        ON participants (id) WHERE typeof(answers) = 'text'
+        ''',
+        'CREATE INDEX idx_tests_creator ON tests (creator_id, created_at)',
+        'CREATE INDEX idx_tests_created_at ON tests (created_at)',
+        '''
+        CREATE INDEX idx_tests_json_answers
+        ON tests (test_id) WHERE typeof(creator_answers) = 'text'
+        ''',
+    ]),
+]
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    async with conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+async def migrate(conn: aiosqlite.Connection, shard: Shard = (0, 1)) -> int:
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    await conn.commit()
+
+    current = await get_schema_version(conn)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+
+        try:
+            await conn.execute('BEGIN IMMEDIATE')
+            # Another process may have applied it while we waited for the lock.
+            if await get_schema_version(conn) >= version:
+                await conn.rollback()
+                current = version
+                continue
+
+            logging.info(f"Applying schema migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    await step(conn, shard)
+                else:
+                    await conn.execute(step)
+            await conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        current = version
+
+    return current
@@ -0,0 +1,98 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+QUESTIONS_FILE = os.getenv(
+    "QUESTIONS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.json")
+)
+QUESTION_SET = os.getenv("QUESTION_SET", "default")
+
+# Callback data prefixes the keyboards are prebuilt for.
+ANSWER_PREFIXES = ("answer", "friend_answer")
+
+# Keeps keyboards usable; it also keeps option indices well below the 0xFF
+# marker reserved by the packed answer format in answers.py.
+MAX_OPTIONS = 10
+
+@dataclass(frozen=True)
+class Question:
+    question: str
+    options: Tuple[str, ...]
+
+class QuestionBank:
+    """An immutable, validated question set with its reply markup prebuilt.
+
+    Handlers look up ``text(i)`` and ``keyboard(i, prefix)`` instead of
+    building InlineKeyboardMarkup objects on every button press.
+    """
+
+    def __init__(self, name: str, raw_questions: list):
+        if not raw_questions:
+            raise ValueError(f"Savollar to'plami bo'sh: {name}")
+
+        questions = []
+        for i, raw in enumerate(raw_questions):
+            text = raw.get("question", "").strip()
+            options = tuple(option.strip() for option in raw.get("options", ()))
+
+            if not text:
+                raise ValueError(f"{name}: {i + 1}-savol matni yo'q")
+            if not 2 <= len(options) <= MAX_OPTIONS:
+                raise ValueError(f"{name}: {i + 1}-savolda 2 dan {MAX_OPTIONS} tagacha javob bo'lishi kerak")
+            if len(set(options)) != len(options) or not all(options):
+                raise ValueError(f"{name}: {i + 1}-savol javoblari bo'sh yoki takrorlangan")
+
+            questions.append(Question(text, options))
+
+        self.name = name
+        self.questions: Tuple[Question, ...] = tuple(questions)
+        self.texts: Tuple[str, ...] = tuple(
+            f"{i + 1} {question.question}" for i, question in enumerate(self.questions)
+        )
+        self.keyboards: Dict[Tuple[int, str], InlineKeyboardMarkup] = {
+            (i, prefix): InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=option, callback_data=f"{prefix}:{i}:{j}")]
+                for j, option in enumerate(question.options)
+            ])
+            for i, question in enumerate(self.questions)
+            for prefix in ANSWER_PREFIXES
+        }
+        self.option_indices: Tuple[Dict[str, int], ...] = tuple(
+            {option: j for j, option in enumerate(question.options)}
+            for question in self.questions
+        )
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def __getitem__(self, index: int) -> Question:
+        return self.questions[index]
+
+    def __iter__(self) -> Iterator[Question]:
+        return iter(self.questions)
+
+    def text(self, index: int) -> str:
+        return self.texts[index]
+
+    def keyboard(self, index: int, prefix: str = "answer") -> InlineKeyboardMarkup:
+        return self.keyboards[(index, prefix)]
+
+    def is_valid_answer(self, index: int, option: int) -> bool:
+        return 0 <= index < len(self.questions) and 0 <= option < len(self.questions[index].options)
+
+def load_question_banks(path: str = QUESTIONS_FILE) -> Dict[str, QuestionBank]:
+    with open(path, encoding="utf-8") as f:
+        raw_sets = json.load(f)
+
+    return {name: QuestionBank(name, raw_questions) for name, raw_questions in raw_sets.items()}
+
+QUESTION_BANKS = load_question_banks()
+
+if QUESTION_SET not in QUESTION_BANKS:
+    raise ValueError(f"Savollar to'plami topilmadi: {QUESTION_SET}")
+
+FRIENDSHIP_TEST_QUESTIONS = QUESTION_BANKS[QUESTION_SET]
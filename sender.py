@@ -0,0 +1,232 @@
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+@dataclass(order=True)
+class OutgoingMessage:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    text: str = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+@dataclass
+class PendingDigest:
+    header: str
+    texts: List[str] = field(default_factory=list)
+    lines: List[str] = field(default_factory=list)
+    flush_handle: Optional[asyncio.TimerHandle] = None
+
+class MessageScheduler:
+    """Outbound message queue that respects Telegram flood limits.
+
+    Messages are sent by one worker in priority order through a global token
+    bucket and per-chat buckets. A ``TelegramRetryAfter`` pauses the affected
+    chat for the requested time and requeues the message.
+    With ``send_coalesced`` the first message to a chat goes out at once; any
+    that follow within ``digest_window`` seconds are collected and sent as a
+    single digest when the window closes.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        digest_window: float = 10.0,
+        max_retries: int = 5,
+        max_queue: int = 10000
+    ):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=max_queue)
+        self.digests: Dict[int, PendingDigest] = {}
+        self.delayed: Dict[int, asyncio.TimerHandle] = {}
+        self.seq = itertools.count()
+        self.worker: Optional[asyncio.Task] = None
+        self.busy = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {k: v for k, v in self.chat_buckets.items() if not v.idle}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL):
+        message = OutgoingMessage(priority, next(self.seq), chat_id, text)
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.failed += 1
+            logging.warning(f"Outbound queue full, dropping message to {chat_id}")
+
+    def send_coalesced(self, chat_id: int, text: str, digest_line: str, digest_header: str):
+        digest = self.digests.get(chat_id)
+        if digest is None:
+            self.send(chat_id, text)
+            digest = self.digests[chat_id] = PendingDigest(header=digest_header)
+            loop = asyncio.get_running_loop()
+            digest.flush_handle = loop.call_later(self.digest_window, self._flush_digest, chat_id)
+            return
+
+        digest.texts.append(text)
+        digest.lines.append(digest_line)
+
+    def _flush_digest(self, chat_id: int):
+        digest = self.digests.pop(chat_id, None)
+        if digest is None or not digest.texts:
+            return
+
+        if len(digest.texts) == 1:
+            self.send(chat_id, digest.texts[0])
+            return
+
+        self.coalesced += len(digest.texts) - 1
+        text = digest.header.format(count=len(digest.lines))
+        for line in digest.lines:
+            if len(text) + len(line) + 1 > MAX_MESSAGE_LENGTH - 10:
+                text += "\n..."
+                break
+            text += f"\n{line}"
+        self.send(chat_id, text, PRIORITY_LOW)
+
+    def _requeue_later(self, message: OutgoingMessage, delay: float):
+        loop = asyncio.get_running_loop()
+        handle_id = message.seq
+
+        def requeue():
+            self.delayed.pop(handle_id, None)
+            try:
+                self.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.failed += 1
+
+        self.delayed[handle_id] = loop.call_later(delay, requeue)
+
+    async def _deliver(self, message: OutgoingMessage):
+        chat_bucket = self._chat_bucket(message.chat_id)
+        delay = chat_bucket.delay()
+        if delay > 0:
+            self._requeue_later(message, delay)
+            return
+
+        while (delay := self.global_bucket.delay()) > 0:
+            await asyncio.sleep(delay)
+
+        self.global_bucket.take()
+        chat_bucket.take()
+
+        try:
+            await self.bot.send_message(message.chat_id, message.text)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            message.attempts += 1
+            self.retried += 1
+            chat_bucket.block(e.retry_after)
+            if message.attempts > self.max_retries:
+                self.failed += 1
+                logging.warning(f"Giving up on message to {message.chat_id} after {message.attempts} attempts")
+                return
+            self._requeue_later(message, e.retry_after)
+        except Exception as e:
+            self.failed += 1
+            logging.warning(f"Failed to send message to {message.chat_id}: {e}")
+
+    async def _run(self):
+        while True:
+            message = await self.queue.get()
+            self.busy = True
+            try:
+                await self._deliver(message)
+            finally:
+                self.busy = False
+
+    def start(self):
+        if self.worker is None:
+            self.worker = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10.0):
+        for chat_id in list(self.digests):
+            self.digests[chat_id].flush_handle.cancel()
+            self._flush_digest(chat_id)
+
+        deadline = time.monotonic() + timeout
+        while (not self.queue.empty() or self.delayed or self.busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        dropped = self.queue.qsize() + len(self.delayed)
+        if dropped:
+            logging.warning(f"Outbound queue not drained, {dropped} messages dropped")
+
+        for handle in self.delayed.values():
+            handle.cancel()
+        self.delayed.clear()
+
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
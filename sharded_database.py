@@ -0,0 +1,156 @@
+import asyncio
+import os
+import zlib
+from datetime import date
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+from database import ACTION_TYPES, Database
+from storage import Storage
+
+def shard_files(db_file: str, shards: int) -> List[str]:
+    """``friendship_test.db`` -> ``friendship_test.0.db``, ``friendship_test.1.db``, ..."""
+    base, ext = os.path.splitext(db_file)
+    return [f"{base}.{i}{ext}" for i in range(shards)]
+
+def shard_index(key, shards: int) -> int:
+    # crc32 rather than hash(): str hashes are salted per process, and every
+    # worker process must route a key to the same file.
+    return zlib.crc32(str(key).encode()) % shards
+
+class ShardedDatabase(Storage):
+    """Storage spread over several SQLite files, each with its own writer.
+
+    A test, its participants and answer counters live on the shard of its
+    creator, which the test id encodes as ``test_id % n``; event logs and
+    FSM sessions on the shard picked by ``user_id``. Per-test queries touch
+    one shard; creator lookups and stats fan out to all shards and merge
+    the results.
+
+    The number of shards is part of the routing: changing it requires
+    moving the data.
+    """
+
+    def __init__(self, db_files: List[str], **kwargs):
+        if not db_files:
+            raise ValueError("At least one shard is required")
+        self._shards = [
+            Database(db_file, shard_index=i, shard_count=len(db_files), **kwargs)
+            for i, db_file in enumerate(db_files)
+        ]
+
+    @property
+    def shards(self) -> List[Database]:
+        return self._shards
+
+    def shard_for_test(self, test_id: int) -> Database:
+        # Each shard numbers its tests index, index + n, index + 2n, ...
+        return self._shards[test_id % len(self._shards)]
+
+    def shard_for_user(self, user_id: int) -> Database:
+        return self._shards[shard_index(user_id, len(self._shards))]
+
+    async def connect(self):
+        await asyncio.gather(*(shard.connect() for shard in self._shards))
+
+    async def close(self):
+        await asyncio.gather(*(shard.close() for shard in self._shards))
+
+    async def save_test(self, creator_id: int, creator_answers: bytes) -> Optional[int]:
+        return await self.shard_for_user(creator_id).save_test(creator_id, creator_answers)
+
+    async def resolve_legacy_test_id(self, legacy_id: str) -> Optional[int]:
+        # Text ids were routed by their hash before tests were numbered.
+        return await self._shards[shard_index(legacy_id, len(self._shards))].resolve_legacy_test_id(legacy_id)
+
+    async def get_test(self, test_id: int) -> Optional[Mapping]:
+        return await self.shard_for_test(test_id).get_test(test_id)
+
+    def invalidate_test(self, test_id: int):
+        self.shard_for_test(test_id).invalidate_test(test_id)
+
+    async def save_participant(self, test_id: int, user_id: int, answers: bytes, correct_count: int) -> bool:
+        return await self.shard_for_test(test_id).save_participant(test_id, user_id, answers, correct_count)
+
+    async def has_participant_completed(self, test_id: int, user_id: int) -> bool:
+        return await self.shard_for_test(test_id).has_participant_completed(test_id, user_id)
+
+    async def get_tests_by_creator(self, creator_id: int, limit: int = 10) -> List[Dict]:
+        results = await asyncio.gather(*(
+            shard.get_tests_by_creator(creator_id, limit) for shard in self._shards
+        ))
+        tests = [test for shard_tests in results for test in shard_tests]
+        return sorted(tests, key=lambda test: test['created_at'], reverse=True)[:limit]
+
+    async def get_results_summary(self, test_id: int, top: int = 5) -> Dict:
+        return await self.shard_for_test(test_id).get_results_summary(test_id, top)
+
+    async def get_answer_breakdown(self, test_id: int) -> Dict[int, Dict[int, int]]:
+        return await self.shard_for_test(test_id).get_answer_breakdown(test_id)
+
+    async def get_results_page(
+        self,
+        test_id: int,
+        after: Optional[Tuple[int, int]] = None,
+        limit: int = 10
+    ) -> List[Dict]:
+        return await self.shard_for_test(test_id).get_results_page(test_id, after, limit)
+
+    def iter_participants(self, test_id: int, chunk_size: int = 500) -> AsyncIterator[Dict]:
+        return self.shard_for_test(test_id).iter_participants(test_id, chunk_size)
+
+    async def log_user_action(self, user_id: int, action_type: str):
+        return await self.shard_for_user(user_id).log_user_action(user_id, action_type)
+
+    async def backfill_stats(self) -> int:
+        rows = await asyncio.gather(*(shard.backfill_stats() for shard in self._shards))
+        if any(count < 0 for count in rows):
+            return -1
+        return sum(rows)
+
+    async def get_stats(self, start: date, end: date) -> Dict:
+        results = await asyncio.gather(*(shard.get_stats(start, end) for shard in self._shards))
+        if not all(results):
+            return {}
+
+        stats = dict.fromkeys(ACTION_TYPES, 0)
+        for shard_stats in results:
+            for action_type, count in shard_stats.items():
+                stats[action_type] = stats.get(action_type, 0) + count
+        return stats
+
+    async def get_daily_breakdown(self, start: date, end: date) -> Dict[str, Dict]:
+        results = await asyncio.gather(*(shard.get_daily_breakdown(start, end) for shard in self._shards))
+
+        breakdown: Dict[str, Dict] = {}
+        for shard_breakdown in results:
+            for day, day_stats in shard_breakdown.items():
+                merged = breakdown.setdefault(day, dict.fromkeys(ACTION_TYPES, 0))
+                for action_type, count in day_stats.items():
+                    merged[action_type] = merged.get(action_type, 0) + count
+        return dict(sorted(breakdown.items()))
+
+    def shard_for_key(self, key: bytes) -> Database:
+        return self._shards[shard_index(key.hex(), len(self._shards))]
+
+    async def get_file_id(self, key: bytes) -> Optional[str]:
+        return await self.shard_for_key(key).get_file_id(key)
+
+    async def save_file_id(self, key: bytes, file_id: str):
+        await self.shard_for_key(key).save_file_id(key, file_id)
+
+    async def delete_file_id(self, key: bytes):
+        await self.shard_for_key(key).delete_file_id(key)
+
+    async def prune_file_ids(self, max_entries: int) -> int:
+        per_shard = max(1, max_entries // len(self._shards))
+        return sum(await asyncio.gather(*(shard.prune_file_ids(per_shard) for shard in self._shards)))
+
+    def cache_stats(self) -> dict:
+        stats: Dict[str, int] = {}
+        for shard in self._shards:
+            for key, value in shard.cache_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def pending_events(self) -> int:
+        return sum(shard.pending_events() for shard in self._shards)
@@ -0,0 +1,47 @@
+from typing import Optional
+
+# Tests are numbered by the database (see Database.save_test) and shown in
+# links as base62, e.g. https://t.me/<bot>?start=3kT. IDs made before that,
+# like "test_123456789_4821", are still accepted and looked up in
+# legacy_test_ids.
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+INDEX = {char: i for i, char in enumerate(ALPHABET)}
+LEGACY_PREFIX = "test_"
+
+# Deep-link payloads are limited to 64 characters; 11 base62 digits
+# already cover every 64-bit integer.
+MAX_CODE_LENGTH = 11
+
+# Largest value SQLite can store in an INTEGER column.
+MAX_TEST_ID = 2 ** 63 - 1
+
+def encode_test_id(test_id: int) -> str:
+    if test_id < 0:
+        raise ValueError(f"Negative test id: {test_id}")
+
+    chars = []
+    while True:
+        test_id, digit = divmod(test_id, 62)
+        chars.append(ALPHABET[digit])
+        if not test_id:
+            return ''.join(reversed(chars))
+
+def decode_test_id(code: str) -> Optional[int]:
+    """Numeric test id of a base62 code, or None if it is not one."""
+    if not code or len(code) > MAX_CODE_LENGTH:
+        return None
+
+    test_id = 0
+    for char in code:
+        digit = INDEX.get(char)
+        if digit is None:
+            return None
+        test_id = test_id * 62 + digit
+
+    if test_id > MAX_TEST_ID:
+        return None
+    return test_id
+
+def is_legacy_test_id(code: str) -> bool:
+    return code.startswith(LEGACY_PREFIX)
@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+if TYPE_CHECKING:
+    from database import Database
+
+class Storage(ABC):
+    """Everything the bot needs from its storage backend.
+
+    ``Database`` keeps all data in one SQLite file; ``ShardedDatabase``
+    spreads it over several. Code that needs a raw connection (the FSM
+    storage) asks for the shard that owns a user via ``shard_for_user``.
+    """
+
+    @property
+    @abstractmethod
+    def shards(self) -> List["Database"]:
+        ...
+
+    @abstractmethod
+    def shard_for_user(self, user_id: int) -> "Database":
+        ...
+
+    @abstractmethod
+    async def connect(self):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    @abstractmethod
+    async def save_test(self, creator_id: int, creator_answers: bytes) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def resolve_legacy_test_id(self, legacy_id: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def get_test(self, test_id: int) -> Optional[Mapping]:
+        ...
+
+    @abstractmethod
+    def invalidate_test(self, test_id: int):
+        ...
+
+    @abstractmethod
+    async def save_participant(self, test_id: int, user_id: int, answers: bytes, correct_count: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def has_participant_completed(self, test_id: int, user_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def get_tests_by_creator(self, creator_id: int, limit: int = 10) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    async def get_results_summary(self, test_id: int, top: int = 5) -> Dict:
+        ...
+
+    @abstractmethod
+    async def get_answer_breakdown(self, test_id: int) -> Dict[int, Dict[int, int]]:
+        ...
+
+    @abstractmethod
+    async def get_results_page(
+        self,
+        test_id: int,
+        after: Optional[Tuple[int, int]] = None,
+        limit: int = 10
+    ) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def iter_participants(self, test_id: int, chunk_size: int = 500) -> AsyncIterator[Dict]:
+        ...
+
+    @abstractmethod
+    async def log_user_action(self, user_id: int, action_type: str):
+        ...
+
+    @abstractmethod
+    async def backfill_stats(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_stats(self, start: date, end: date) -> Dict:
+        ...
+
+    @abstractmethod
+    async def get_daily_breakdown(self, start: date, end: date) -> Dict[str, Dict]:
+        ...
+
+    @abstractmethod
+    async def get_file_id(self, key: bytes) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def save_file_id(self, key: bytes, file_id: str):
+        ...
+
+    @abstractmethod
+    async def delete_file_id(self, key: bytes):
+        ...
+
+    @abstractmethod
+    async def prune_file_ids(self, max_entries: int) -> int:
+        ...
+
+    @abstractmethod
+    def cache_stats(self) -> dict:
+        ...
+
+    @abstractmethod
+    def pending_events(self) -> int:
+        ...
+
+    async def get_daily_stats(self) -> Dict:
+        today = datetime.utcnow().date()
+        return await self.get_stats(today, today + timedelta(days=1))
+
+    async def get_monthly_stats(self) -> Dict:
+        first_day = datetime.utcnow().date().replace(day=1)
+        next_month = (first_day + timedelta(days=32)).replace(day=1)
+        return await self.get_stats(first_day, next_month)
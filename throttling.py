@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Collection, Dict, Mapping, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from cache import TTLCache
+from metrics import Metrics, metrics
+
+# (max events, window in seconds)
+Limit = Tuple[int, float]
+
+def parse_limit(value: str) -> Optional[Limit]:
+    """``"20/10"`` -> 20 events per 10 seconds; empty or ``"0"`` -> no limit."""
+    if not value or value == "0":
+        return None
+    count, _, window = value.partition("/")
+    return int(count), float(window or 1)
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Inner middleware shedding excess load before a handler touches the database.
+
+    Each user gets a sliding window per handler: ``limits`` maps a handler
+    name or, failing that, an event type (``message``, ``callback_query``)
+    to ``(count, seconds)``. Updates over the limit are dropped. At most
+    ``max_concurrency`` handlers run at once; others wait up to ``max_wait``
+    seconds for a slot and are dropped after that. Windows live in a
+    bounded TTL cache, so idle users are forgotten.
+    """
+
+    def __init__(
+        self,
+        limits: Mapping[str, Optional[Limit]],
+        max_concurrency: int = 100,
+        max_wait: float = 5.0,
+        cache_size: int = 100000,
+        exempt: Collection[int] = (),
+        registry: Metrics = metrics
+    ):
+        self.limits = {key: limit for key, limit in limits.items() if limit}
+        self.windows = TTLCache(
+            maxsize=cache_size,
+            ttl=max((window for _, window in self.limits.values()), default=60.0)
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.exempt = frozenset(exempt)
+        self.metrics = registry
+        self.running = 0
+
+    def allow(self, user_id: int, key: str, limit: Limit) -> bool:
+        count, window = limit
+        now = time.monotonic()
+
+        events = self.windows.get((user_id, key))
+        if events is None:
+            events = deque()
+        while events and events[0] <= now - window:
+            events.popleft()
+
+        if len(events) >= count:
+            return False
+        events.append(now)
+        self.windows.set((user_id, key), events, ttl=window)
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        event_type = data['event_update'].event_type
+        user = data.get('event_from_user')
+
+        if user is not None and user.id not in self.exempt:
+            key = name if name in self.limits else event_type
+            limit = self.limits.get(key)
+            if limit and not self.allow(user.id, key, limit):
+                self.metrics.inc("bot_throttled_total", reason="user", handler=name)
+                return None
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.metrics.inc("bot_throttled_total", reason="busy", handler=name)
+            return None
+        self.metrics.observe("bot_throttle_wait_seconds", time.perf_counter() - started)
+
+        self.running += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
+            self.semaphore.release()
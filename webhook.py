@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+class ConcurrentRequestHandler(SimpleRequestHandler):
+    """Webhook handler that acknowledges updates at once and processes them in
+    background tasks, at most ``max_concurrency`` at a time.
+
+    When ``max_pending`` updates are already waiting, new ones get a 503 so
+    Telegram redelivers them later instead of the bot queueing without bound.
+    On shutdown the handler stops accepting updates and waits up to
+    ``drain_timeout`` seconds for the in-flight ones to finish.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        max_concurrency: int = 64,
+        max_pending: int = 1000,
+        drain_timeout: float = 30.0,
+        secret_token: Optional[str] = None,
+        **data: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.drain_timeout = drain_timeout
+        self.tasks: Set[asyncio.Task] = set()
+        self.draining = False
+
+    async def _process_update(self, bot: Bot, update: Dict[str, Any]):
+        async with self.semaphore:
+            try:
+                await self._background_feed_update(bot=bot, update=update)
+            except Exception as e:
+                logging.exception(f"Webhook update failed: {e}")
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if self.draining or len(self.tasks) >= self.max_pending:
+            return web.Response(status=503, text="Busy")
+
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self._process_update(bot, update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'draining' if self.draining else 'ok',
+            'pending': len(self.tasks),
+            'max_concurrency': self.max_concurrency,
+            'max_pending': self.max_pending
+        }, status=503 if self.draining else 200)
+
+    async def drain(self):
+        self.draining = True
+        if not self.tasks:
+            return
+
+        logging.info(f"Waiting for {len(self.tasks)} webhook updates to finish")
+        done, pending = await asyncio.wait(set(self.tasks), timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"Cancelled {len(pending)} webhook updates after drain timeout")
+
+    async def close(self) -> None:
+        await self.drain()
+        await super().close()
+
+def create_app(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = "/webhook",
+    webhook_url: Optional[str] = None,
+    secret_token: Optional[str] = None,
+    max_concurrency: int = 64,
+    max_pending: int = 1000,
+    drain_timeout: float = 30.0
+) -> web.Application:
+    app = web.Application()
+
+    handler = ConcurrentRequestHandler(
+        dp, bot,
+        max_concurrency=max_concurrency,
+        max_pending=max_pending,
+        drain_timeout=drain_timeout,
+        secret_token=secret_token
+    )
+    # Registered before setup_application so the drain runs ahead of the
+    # dispatcher's shutdown hooks (which close the database).
+    handler.register(app, path=path)
+    app.router.add_get("/health", handler.handle_health)
+    app['webhook_handler'] = handler
+
+    if webhook_url:
+        async def set_webhook(app: web.Application):
+            await bot.set_webhook(f"{webhook_url.rstrip('/')}{path}", secret_token=secret_token)
+        app.on_startup.append(set_webhook)
+
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    reuse_port: bool = False,
+    **kwargs: Any
+):
+    # With reuse_port several worker processes can listen on the same port
+    # and the kernel spreads incoming webhook requests between them.
+    app = create_app(dp, bot, **kwargs)
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    logging.info(f"Webhook server listening on {host}:{port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()